@@ -1,2 +1,4 @@
 from .geospine import GeoSpine
-from .tree import OD_tree
\ No newline at end of file
+from .tree import OD_tree
+from .sqlite_tree import SQLite_OD_tree
+from .cache import AggregateCache
@@ -0,0 +1,120 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+import pandas as pd
+from .geospine import GeoSpine
+
+
+class AggregateCache:
+    """
+    On-disk store of the true aggregates of an OD_tree (the flows summed by level columns and the child indexes), so
+    that the runs on the same dataset start from the aggregates computed by the first one. Each aggregate is a folder
+    of .npy arrays in <folder>/<fingerprint>, the fingerprint is a hash of the dataset files, the spine and the final
+    level: when any of them changes the cache is empty. The aggregates of the other fingerprints are kept, since another
+    run can be using them, until `evict` is called.
+    """
+
+    def __init__(self, folder: str, fingerprint: str):
+        """
+        :param folder: str, folder of the cache
+        :param fingerprint: str, fingerprint of the dataset, see `get_fingerprint`
+        """
+        self.folder = folder
+        self.fingerprint = fingerprint
+        self.path = os.path.join(folder, fingerprint)
+        os.makedirs(self.path, exist_ok=True)
+
+    @classmethod
+    def for_dataset(cls, folder: str, files: list[str], spine: GeoSpine, final_level: int) -> "AggregateCache":
+        """
+        Return the cache of a dataset
+        :param folder: str, folder of the cache
+        :param files: list[str], files of the dataset, see `data_structure.utils.get_dataset_files`
+        :param spine: GeoSpine, spine of the dataset
+        :param final_level: int, last level of the spine used by the tree
+        :return: AggregateCache
+        """
+        return cls(folder, get_fingerprint(files, spine, final_level))
+
+    def evict(self):
+        """
+        Remove the aggregates of the other fingerprints (e.g. of the previous versions of the dataset). No other run
+        must be using them
+        """
+        for entry in os.listdir(self.folder):
+            if entry != self.fingerprint and os.path.isdir(os.path.join(self.folder, entry)):
+                shutil.rmtree(os.path.join(self.folder, entry))
+
+    def load(self, name: str) -> dict[str, np.ndarray]:
+        """
+        Return the arrays of an aggregate, memory-mapped, or None if it is not in the cache
+        :param name: str, name of the aggregate
+        """
+        path = os.path.join(self.path, name)
+        if not os.path.isdir(path):
+            return None
+        return {file[:-len(".npy")]: np.load(os.path.join(path, file), mmap_mode="r") for file in os.listdir(path)}
+
+    def save(self, name: str, arrays: dict[str, np.ndarray]):
+        """
+        Save the arrays of an aggregate. The folder is written aside, in a folder of its own, and renamed, so an
+        interrupted run never leaves a partial aggregate and concurrent runs never write the same files. If another
+        run saved the aggregate first, its copy is kept (the aggregates of a fingerprint are the same)
+        :param name: str, name of the aggregate
+        :param arrays: dict[str, np.ndarray], arrays of the aggregate
+        """
+        path = os.path.join(self.path, name)
+        tmp_path = tempfile.mkdtemp(dir=self.path, prefix=name + ".", suffix=".tmp")
+        try:
+            for key, array in arrays.items():
+                np.save(os.path.join(tmp_path, key + ".npy"), array, allow_pickle=False)
+            os.replace(tmp_path, path)
+        except OSError:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            if not os.path.isdir(path):
+                raise
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+
+
+def get_fingerprint(files: list[str], spine: GeoSpine, final_level: int) -> str:
+    """
+    Return a hash of the content of the dataset files, the arrays of the spine and the final level
+    :param files: list[str], files of the dataset
+    :param spine: GeoSpine, spine of the dataset
+    :param final_level: int, last level of the spine used by the tree
+    :return: str, hexadecimal digest
+    """
+    digest = hashlib.sha256()
+    for file in sorted(files):
+        digest.update(os.path.basename(file).encode())
+        with open(file, "rb") as f:
+            while block := f.read(2 ** 24):
+                digest.update(block)
+    _update_digest(digest, spine.to_arrays())
+    digest.update(str(final_level).encode())
+    return digest.hexdigest()[:32]
+
+
+def get_data_fingerprint(data: pd.DataFrame, spine: GeoSpine) -> str:
+    """
+    Return a hash of the columns of a dataset (e.g. the flows of a tree at its final level) and the arrays of the spine
+    :param data: pd.DataFrame, dataset
+    :param spine: GeoSpine, spine of the dataset
+    :return: str, hexadecimal digest
+    """
+    digest = hashlib.sha256()
+    for column in data.columns:
+        digest.update(str(column).encode())
+        _update_digest(digest, [data[column].to_numpy()])
+    _update_digest(digest, spine.to_arrays())
+    return digest.hexdigest()[:32]
+
+
+def _update_digest(digest, arrays: list[np.ndarray]):
+    for array in arrays:
+        digest.update(str(array.dtype).encode())
+        digest.update(np.ascontiguousarray(array).tobytes())
@@ -1,3 +1,11 @@
+import os
+import numpy as np
+import pandas as pd
+
+# names of the files of the binary spine format
+SPINE_ARRAYS = ("labels", "level_offsets", "parents")
+
+
 class GeoSpine:
     """
     This class is a wrapper for a nested dictionary that represents a hierarchical spine.
@@ -6,16 +14,202 @@ class GeoSpine:
     """
 
     def __init__(self, nested_dictionary: dict):
+        self._original_arrays = None
         self.original_spine = nested_dictionary
         self.geo_spine = nested_dictionary
         self.depth = self.get_depth()
+        self._build_index()
+
+    @classmethod
+    def from_arrays(cls, labels: np.ndarray, level_offsets: np.ndarray, parents: np.ndarray) -> "GeoSpine":
+        """
+        Create a spine directly from its compiled arrays (see `to_arrays`), without building the nested dictionary.
+        The arrays are not copied, so they can be memory-mapped. The nested dictionary is rebuilt only if
+        `geo_spine` or `original_spine` are accessed.
+        :param labels: np.ndarray, label of every node, level by level; the entry of the root is a placeholder
+        :param level_offsets: np.ndarray, the nodes of level l are in positions [level_offsets[l], level_offsets[l + 1])
+        :param parents: np.ndarray, position (in the level above) of the father of every node, -1 for the root
+        """
+        spine = cls.__new__(cls)
+        spine._original_arrays = (labels, level_offsets, parents)
+        spine._original_spine = None
+        spine._geo_spine = None
+        spine.depth = len(level_offsets) - 2
+        spine._build_index_from_arrays(spine.depth)
+        return spine
+
+    @property
+    def original_spine(self) -> dict:
+        if self._original_spine is None:
+            self._original_spine = self._get_nested_dictionary(*self._original_arrays)
+        return self._original_spine
+
+    @original_spine.setter
+    def original_spine(self, nested_dictionary: dict):
+        self._original_spine = nested_dictionary
+
+    @property
+    def geo_spine(self) -> dict:
+        if self._geo_spine is None:
+            self._geo_spine = self._get_nested_dictionary(*self.to_arrays())
+        return self._geo_spine
+
+    @geo_spine.setter
+    def geo_spine(self, nested_dictionary: dict):
+        self._geo_spine = nested_dictionary
+        # the level views are computed from the nested dictionary
+        self._level_views = {}
+
+    def _build_index(self):
+        """
+        Compile the nested dictionary into flat arrays, one entry per level (zero level is the root):
+            - _nodes[level]: array of the nodes of the level, grouped by father, so that the children of a node are a
+              contiguous slice of the next level
+            - _parents[level]: position (in the level above) of the father of each node, -1 for the root
+            - _child_offsets[level]: CSR offsets, the children of the node in position i are the nodes of the next
+              level in positions [_child_offsets[level][i], _child_offsets[level][i + 1])
+            - _positions[level]: hash map node -> position in the level, built at the first lookup
+        """
+        nodes = [np.array([0], dtype=object)]
+        parents = [np.array([-1], dtype=np.int64)]
+        child_offsets = []
+        subtrees = [self.geo_spine]
+        for level in range(1, self.depth + 1):
+            level_nodes, level_parents, level_subtrees = [], [], []
+            offsets = np.zeros(len(subtrees) + 1, dtype=np.int64)
+            for position, subtree in enumerate(subtrees):
+                for node, children in subtree.items():
+                    level_nodes.append(node)
+                    level_parents.append(position)
+                    level_subtrees.append(children if isinstance(children, dict) else {})
+                offsets[position + 1] = len(level_nodes)
+            array = np.empty(len(level_nodes), dtype=object)
+            array[:] = level_nodes
+            nodes.append(array)
+            parents.append(np.array(level_parents, dtype=np.int64))
+            child_offsets.append(offsets)
+            subtrees = level_subtrees
+        # the last level has no children
+        child_offsets.append(np.zeros(len(subtrees) + 1, dtype=np.int64))
+
+        self._nodes: list[np.ndarray] = nodes
+        self._parents: list[np.ndarray] = parents
+        self._child_offsets: list[np.ndarray] = child_offsets
+        self._positions: list[dict] = [None] * len(nodes)
+        self._clear_cache()
+
+    def _build_index_from_arrays(self, depth: int):
+        """
+        Build the index of `_build_index` from the original compiled arrays, keeping only the levels up to depth.
+        Nodes and parents are views of the original arrays.
+        :param depth: int, number of levels to keep
+        """
+        labels, level_offsets, parents = self._original_arrays
+        original_depth = len(level_offsets) - 2
+        nodes = [np.array([0], dtype=object)]
+        level_parents = [np.array([-1], dtype=np.int64)]
+        for level in range(1, depth + 1):
+            if level <= original_depth:
+                start, end = level_offsets[level], level_offsets[level + 1]
+                nodes.append(labels[start:end])
+                level_parents.append(parents[start:end])
+            else:
+                nodes.append(labels[:0])
+                level_parents.append(parents[:0])
+        # children are grouped by father, so the offsets are given by the parent pointers of the next level
+        child_offsets = [np.searchsorted(level_parents[level + 1], np.arange(len(nodes[level]) + 1))
+                         for level in range(depth)]
+        child_offsets.append(np.zeros(len(nodes[depth]) + 1, dtype=np.int64))
+
+        self._nodes: list[np.ndarray] = nodes
+        self._parents: list[np.ndarray] = level_parents
+        self._child_offsets: list[np.ndarray] = child_offsets
+        self._positions: list[dict] = [None] * len(nodes)
+        self._clear_cache()
+
+    def _clear_cache(self):
+        """
+        Drop the memoized level views and node lists, called every time the index is (re)built
+        """
+        self._level_views: dict[int, dict] = {}
+        self._level_nodes: dict[int, list] = {}
+        self._label_indexes: dict[int, pd.Index] = {}
+
+    def _get_positions_map(self, level: int) -> dict:
+        """
+        Return the hash map node -> position of a level, building it at the first call
+        :param level: int, level of the spine
+        """
+        if self._positions[level] is None:
+            level_nodes = self._nodes[level].tolist()
+            self._positions[level] = dict(zip(level_nodes, range(len(level_nodes))))
+        return self._positions[level]
+
+    def to_arrays(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Return the compiled representation of the spine: (labels, level_offsets, parents).
+        Labels of all levels are concatenated in a single table (the root entry is a placeholder, the root is always 0),
+        level_offsets delimits the levels and parents contains the position of the father of each node in its level.
+        Labels must be all integers or all strings.
+        """
+        level_offsets = np.zeros(self.depth + 2, dtype=np.int64)
+        level_offsets[1:] = np.cumsum([len(level_nodes) for level_nodes in self._nodes])
+        labels = np.asarray([label for level_nodes in self._nodes[1:] for label in level_nodes.tolist()])
+        if len(labels) == 0:
+            labels = labels.astype(np.int64)
+        if labels.dtype.kind not in "iuU":
+            raise ValueError(f"Labels of type {labels.dtype} are not supported, labels must be all int or all str")
+        labels = np.concatenate([np.zeros(1, dtype=labels.dtype), labels])
+        parents = np.concatenate(self._parents).astype(np.int64)
+        return labels, level_offsets, parents
+
+    def save(self, folder_path: str):
+        """
+        Save the spine in binary format, one .npy file for each array returned by `to_arrays`
+        :param folder_path: str, folder where to save the spine
+        """
+        os.makedirs(folder_path, exist_ok=True)
+        for name, array in zip(SPINE_ARRAYS, self.to_arrays()):
+            np.save(os.path.join(folder_path, name + ".npy"), array)
+
+    @classmethod
+    def load(cls, folder_path: str, mmap_mode: str = "r") -> "GeoSpine":
+        """
+        Load a spine saved with `save`, by default the arrays are memory-mapped
+        :param folder_path: str, folder containing the spine
+        :param mmap_mode: str, memory-map mode passed to np.load, None to read the arrays in memory
+        """
+        arrays = [np.load(os.path.join(folder_path, name + ".npy"), mmap_mode=mmap_mode) for name in SPINE_ARRAYS]
+        return cls.from_arrays(*arrays)
+
+    @staticmethod
+    def _get_nested_dictionary(labels: np.ndarray, level_offsets: np.ndarray, parents: np.ndarray) -> dict:
+        """
+        Rebuild the nested dictionary from the compiled arrays, from the leaves to the root
+        """
+        depth = len(level_offsets) - 2
+        if depth == 0:
+            return {}
+        subtrees = [{} for _ in range(level_offsets[depth + 1] - level_offsets[depth])]
+        for level in range(depth, 0, -1):
+            start, end = level_offsets[level], level_offsets[level + 1]
+            level_labels = labels[start:end].tolist()
+            level_parents = parents[start:end]
+            fathers = [{} for _ in range(level_offsets[level] - level_offsets[level - 1])]
+            for label, father, subtree in zip(level_labels, level_parents.tolist(), subtrees):
+                fathers[father][label] = subtree
+            subtrees = fathers
+        return subtrees[0]
 
     def access_level(self, level: int) -> dict:
         """
-        Access to a level of the nested dictionary
+        Access to a level of the nested dictionary. The view is memoized, it must not be modified
         :param level:int level of the nested dictionary, zero level is the root
         """
 
+        if level in self._level_views:
+            return self._level_views[level]
+
         # Helper function for recursive traversal
         def traverse(d, current_level):
             if current_level == level:
@@ -26,7 +220,8 @@ class GeoSpine:
                     result.update(traverse(value, current_level + 1))
             return result
 
-        return traverse(self.geo_spine, 1)
+        self._level_views[level] = traverse(self.geo_spine, 1)
+        return self._level_views[level]
 
     def update_spine_to_level(self, final_level: int):
         """
@@ -58,23 +253,36 @@ class GeoSpine:
 
             return tree_subset
 
+        if self._original_spine is None:
+            # the spine is backed by arrays, truncate them without building the nested dictionary
+            self.geo_spine = None
+            self.depth = final_level
+            self._build_index_from_arrays(final_level)
+            return
         self.geo_spine = _get_tree_to_level(tree=self.original_spine, final_level=final_level)
         self.depth = final_level
+        self._build_index()
 
     def get_nodes(self, level: int) -> list[any]:
         """
-        Returns the list of nodes in a level
+        Returns the list of nodes in a level. The list is memoized, it must not be modified
         :param level: int, level of the nested dictionary, zero level is the root
         """
 
         if level > self.depth:
             raise Exception("Level out of range, max level is: ", self.depth - 1)
-        if level == 0:
-            return [0]
-        try:
-            return list(self.access_level(level).keys())
-        except KeyError:
-            print("Level not found")
+        if level not in self._level_nodes:
+            self._level_nodes[level] = self._nodes[level].tolist()
+        return self._level_nodes[level]
+
+    def level_size(self, level: int) -> int:
+        """
+        Returns the number of nodes in a level, without building the list of nodes
+        :param level: int, level of the nested dictionary, zero level is the root
+        """
+        if level > self.depth:
+            raise Exception("Level out of range, max level is: ", self.depth - 1)
+        return len(self._nodes[level])
 
     def get_children(self, level: int, father_node: any) -> list[any]:
         """
@@ -83,13 +291,15 @@ class GeoSpine:
         :param node:any, node of the graph at level=a, if level=0 unique node is 0
         """
         if level == 0 and father_node == 0:
-            return list(self.geo_spine.keys())
+            return self._nodes[1].tolist() if self.depth > 0 else []
         if level >= self.depth:
             raise Exception("Level out of range, max level is: ", self.depth - 1)
-        try:
-            return list(self.access_level(level)[father_node].keys())
-        except KeyError:
+        position = self._get_positions_map(level).get(father_node)
+        if position is None:
             print("Node not found")
+            return None
+        offsets = self._child_offsets[level]
+        return self._nodes[level + 1][offsets[position]:offsets[position + 1]].tolist()
 
     def get_father(self, level: int, child_node: any) -> any:
         """
@@ -101,15 +311,20 @@ class GeoSpine:
         if level == 1:
             # return the root
             return 0
-        for node in self.get_nodes(level - 1):
-            if child_node in self.get_children(level - 1, node):
-                return node
+        position = self._get_positions_map(level).get(child_node)
+        if position is None:
+            return None
+        return self._nodes[level - 1][self._parents[level][position]]
 
     def get_depth(self) -> int:
         """
         Returns how many layers has the hierarchical spine
         """
 
+        if self._geo_spine is None:
+            # the spine is backed by arrays
+            return sum(len(level_nodes) > 0 for level_nodes in self._nodes[1:])
+
         # Helper function for recursive depth calculation
         def depth(d):
             if not isinstance(d, dict) or not d:
@@ -250,47 +465,107 @@ class GeoSpine:
         """
         return self.get_paths_from(0, 0)
 
-    # def get_paths(self, nodes: list[tuple[int, any]]) -> list[tuple]:
-    #
-    #     """
-    #     Return the paths from the root to the specified nodes for a batch of nodes.
-    #
-    #     :param nodes: A list of tuples, where each tuple contains (level, node).
-    #     :return: A list of tuples, where each tuple represents the path from the root to the corresponding node.
-    #     """
-    #     # Ensure that all levels are within the valid range
-    #     for level, node in nodes:
-    #         assert 0 <= level <= self.depth, "Level out of range"
-    #
-    #     # Memoization cache for get_father results
-    #     father_cache = {}
-    #
-    #     def get_father_cached(level, node):
-    #         """
-    #         Helper function to get the father of a node with memoization.
-    #         """
-    #         if (level, node) not in father_cache:
-    #             father_cache[(level, node)] = self.get_father(level, node)
-    #         return father_cache[(level, node)]
-    #
-    #     results = []
-    #
-    #     # For each (level, node) in the input list
-    #     for level, node in nodes:
-    #         path = []
-    #
-    #         # Traverse upwards to find the path to the root
-    #         current_level = level
-    #         current_node = node
-    #         while current_level > 0:
-    #             path.append(current_node)
-    #             current_node = get_father_cached(current_level, current_node)
-    #             current_level -= 1
-    #
-    #         # Add the root node at the end
-    #         path.append(0)
-    #
-    #         # Reverse the path to show it from root to the target node
-    #         results.append(tuple(reversed(path)))
-    #
-    #     return results
+    def get_positions(self, level: int, nodes) -> np.ndarray:
+        """
+        Return the positions of a batch of nodes inside their level.
+
+        :param level: The level of the nodes.
+        :param nodes: Iterable of nodes of the level.
+        :return: np.ndarray of int64 positions.
+        """
+        assert 0 <= level <= self.depth, "Level out of range"
+        if level not in self._label_indexes:
+            self._label_indexes[level] = pd.Index(self.get_nodes(level))
+        positions = self._label_indexes[level].get_indexer(pd.Index(nodes))
+        if np.any(positions < 0):
+            raise KeyError(f"Nodes not found at level {level}")
+        return positions.astype(np.int64)
+
+    def encode(self, level: int, nodes) -> np.ndarray:
+        """
+        Return the codes of a batch of nodes of the same level. The code of a node is its position in the level, so
+        codes are dense int32, the root is encoded with 0 and the children of a node have consecutive codes.
+
+        :param level: The level of the nodes.
+        :param nodes: Iterable of nodes of the level.
+        :return: np.ndarray of int32 codes.
+        """
+        return self.get_positions(level, nodes).astype(np.int32)
+
+    def decode(self, level: int, codes) -> np.ndarray:
+        """
+        Return the nodes of a batch of codes of the same level.
+
+        :param level: The level of the nodes.
+        :param codes: np.ndarray of codes.
+        :return: np.ndarray of nodes.
+        """
+        return self._nodes[level][np.asarray(codes, dtype=np.int64)]
+
+    def get_children_codes(self, level: int, father_code: int) -> np.ndarray:
+        """
+        Returns the codes of the children (at level + 1) of the node with code father_code at level.
+
+        :param level: int, level of the father node, zero level is the root.
+        :param father_code: int, code of the father node.
+        :return: np.ndarray of int32 codes.
+        """
+        start, end = self.get_children_range(level, father_code)
+        return np.arange(start, end, dtype=np.int32)
+
+    def get_children_range(self, level: int, father_code) -> tuple:
+        """
+        Returns the range [start, end) of the codes of the children (at level + 1) of the node with code father_code
+        at level. father_code can also be an array of codes, then start and end are arrays.
+
+        :param level: int, level of the father node, zero level is the root.
+        :param father_code: int or np.ndarray, code of the father node.
+        :return: tuple (start, end).
+        """
+        assert 0 <= level < self.depth, "Level out of range"
+        offsets = self._child_offsets[level]
+        father_code = np.asarray(father_code, dtype=np.int64)
+        return offsets[father_code], offsets[father_code + 1]
+
+    def get_father_codes(self, level: int, codes) -> np.ndarray:
+        """
+        Returns the codes of the fathers (at level - 1) of a batch of codes at level.
+
+        :param level: int, level of the nodes.
+        :param codes: np.ndarray of codes.
+        :return: np.ndarray of int32 codes.
+        """
+        assert 0 < level <= self.depth, "Level out of range"
+        return self._parents[level][np.asarray(codes, dtype=np.int64)].astype(np.int32)
+
+    def get_ancestor_positions(self, level: int, positions: np.ndarray) -> np.ndarray:
+        """
+        Return the positions of all the ancestors of a batch of nodes.
+
+        :param level: The level of the nodes.
+        :param positions: np.ndarray, positions of the nodes inside their level.
+        :return: np.ndarray of shape (len(positions), level + 1), entry [i, l] is the position of the ancestor at level
+        l of the i-th node.
+        """
+        assert 0 <= level <= self.depth, "Level out of range"
+        positions = np.asarray(positions, dtype=np.int64)
+        ancestors = np.zeros((len(positions), level + 1), dtype=np.int64)
+        # the root is in position 0, so the first column is already set
+        for current_level in range(level, 0, -1):
+            ancestors[:, current_level] = positions
+            positions = self._parents[current_level][positions]
+        return ancestors
+
+    def get_paths(self, level: int, nodes) -> np.ndarray:
+        """
+        Return the paths from the root to a batch of nodes of the same level.
+
+        :param level: The level of the target nodes.
+        :param nodes: Iterable of target nodes.
+        :return: np.ndarray of shape (len(nodes), level + 1), row i is the path from the root to the i-th node.
+        """
+        ancestors = self.get_ancestor_positions(level, self.get_positions(level, nodes))
+        paths = np.empty(ancestors.shape, dtype=object)
+        for current_level in range(level + 1):
+            paths[:, current_level] = self._nodes[current_level][ancestors[:, current_level]]
+        return paths
@@ -0,0 +1,189 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import numpy as np
+import pandas as pd
+from .geospine import GeoSpine
+from .tree import OD_tree, ChildIndex
+from .cache import AggregateCache
+
+
+class SQLite_OD_tree(OD_tree):
+    """
+    OD_tree whose dataset is stored in a local SQLite database instead of a pd.DataFrame. The hierarchy columns are
+    stored with their int32 codes in the spine, and every aggregation of the tree (get_data_at_level,
+    stable_query_level, the child queries, ...) is a GROUP BY executed by SQLite on indexed columns, so only the
+    aggregated rows of a level are loaded in memory. Use `from_csv` to create the database.
+    """
+
+    def __init__(self,
+                 database_path: str,
+                 spine: GeoSpine,
+                 orig_dest: tuple[str] = None,
+                 flow_column: str = None,
+                 mode: str = "destination",
+                 final_level: int = None,
+                 table: str = "od_flows",
+                 cache: AggregateCache = None):
+        """
+        :param database_path: str, path of the SQLite database created by `from_csv`
+        :param spine: GeoSpine, hierarchy of the nodes
+        :param orig_dest: tuple[str], suffixes of the origin and destination columns
+        :param flow_column: str, column containing the flows
+        :param mode: str, split schedule of the tree, see OD_tree
+        :param final_level: int, last level of the spine, by default the depth of the spine
+        :param table: str, table of the database containing the dataset
+        :param cache: AggregateCache, on-disk store of the aggregates of the dataset, None to compute them
+        """
+        if not os.path.exists(database_path):
+            raise FileNotFoundError(f"Database not found: {database_path}")
+        if final_level is None:
+            final_level = spine.depth
+        if orig_dest is None:
+            orig_dest = ("_ORIG", "_DEST")
+        if flow_column is None:
+            flow_column = "COUNT"
+        self._set_split_schedule(mode, final_level)
+        self.spine = spine
+        self.database_path = database_path
+        self.table = table
+        self.connection = sqlite3.connect(database_path)
+        self.data = None
+        self.orig_dest = orig_dest
+        self.flow_column = flow_column
+        self.cache = cache
+        # per-level sorted aggregates used by the child queries
+        self._child_index: dict[int, ChildIndex] = {}
+
+    @classmethod
+    def from_csv(cls,
+                 csv_path: str,
+                 database_path: str,
+                 spine: GeoSpine,
+                 orig_dest: tuple[str] = None,
+                 flow_column: str = None,
+                 mode: str = "destination",
+                 final_level: int = None,
+                 table: str = "od_flows",
+                 chunksize: int = 10 ** 6,
+                 cache: AggregateCache = None,
+                 fingerprint: str = None) -> "SQLite_OD_tree":
+        """
+        Create the database from a CSV dataset, reading it in chunks so that it never needs to fit in memory. The
+        nodes are replaced with their codes in the spine and an index is created for each pair of origin and
+        destination levels queried by the split schedules.
+        :param csv_path: str, path of the CSV dataset
+        :param database_path: str, path of the database to create, an existing table is replaced. The database is
+                              written aside and renamed, so an interrupted run never leaves a partial database
+        :param spine: GeoSpine, hierarchy of the nodes
+        :param orig_dest: tuple[str], suffixes of the origin and destination columns
+        :param flow_column: str, column containing the flows
+        :param mode: str, split schedule of the tree, see OD_tree
+        :param final_level: int, last level of the spine, by default the depth of the spine
+        :param table: str, table of the database containing the dataset
+        :param chunksize: int, number of rows of the CSV read at a time
+        :param cache: AggregateCache, on-disk store of the aggregates of the dataset, None to compute them
+        :param fingerprint: str, fingerprint of the CSV dataset (see `cache.get_fingerprint`) stored with the table, so
+                            that `get_source_fingerprint` tells if the database is stale
+        :return: SQLite_OD_tree
+        """
+        if orig_dest is None:
+            orig_dest = ("_ORIG", "_DEST")
+        if flow_column is None:
+            flow_column = "COUNT"
+        file, temporary_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(database_path)),
+                                                suffix=".sqlite.tmp")
+        os.close(file)
+        if os.path.exists(database_path):
+            # keep the other tables of the database
+            shutil.copyfile(database_path, temporary_path)
+        connection = sqlite3.connect(temporary_path)
+        try:
+            connection.execute(f'DROP TABLE IF EXISTS "{table}"')
+            for chunk in pd.read_csv(csv_path, chunksize=chunksize):
+                codes = {}
+                for level in range(spine.depth + 1):
+                    for suffix in orig_dest:
+                        column = "LEVEL" + str(level) + suffix
+                        if column in chunk.columns:
+                            codes[column] = spine.encode(level, chunk[column])
+                codes[flow_column] = chunk[flow_column].astype(np.int64)
+                pd.DataFrame(codes).to_sql(table, connection, if_exists="append", index=False)
+            # covering indexes, each GROUP BY of the tree reads only the index
+            for orig_level in range(spine.depth + 1):
+                for dest_level in range(max(orig_level - 1, 0), min(orig_level + 2, spine.depth + 1)):
+                    orig_column = "LEVEL" + str(orig_level) + orig_dest[0]
+                    dest_column = "LEVEL" + str(dest_level) + orig_dest[1]
+                    connection.execute(f'CREATE INDEX "{table}_{orig_column}_{dest_column}" ON "{table}" '
+                                       f'("{orig_column}", "{dest_column}", "{flow_column}")')
+            # fingerprint of the CSV of each table, read by get_source_fingerprint
+            connection.execute('CREATE TABLE IF NOT EXISTS "fingerprints" '
+                               '("table" TEXT PRIMARY KEY, "fingerprint" TEXT)')
+            connection.execute('INSERT OR REPLACE INTO "fingerprints" VALUES (?, ?)', (table, fingerprint))
+            connection.commit()
+        except BaseException:
+            connection.close()
+            os.remove(temporary_path)
+            raise
+        connection.close()
+        os.replace(temporary_path, database_path)
+        return cls(database_path, spine, orig_dest=orig_dest, flow_column=flow_column, mode=mode,
+                   final_level=final_level, table=table, cache=cache)
+
+    @staticmethod
+    def get_source_fingerprint(database_path: str, table: str = "od_flows") -> str:
+        """
+        Return the fingerprint of the CSV dataset a table was created from, None if the database or the fingerprint
+        do not exist
+        :param database_path: str, path of the SQLite database
+        :param table: str, table of the database containing the dataset
+        :return: str, fingerprint given to `from_csv`
+        """
+        if not os.path.exists(database_path):
+            return None
+        connection = sqlite3.connect(database_path)
+        try:
+            row = connection.execute('SELECT "fingerprint" FROM "fingerprints" WHERE "table" = ?', (table,)).fetchone()
+        except sqlite3.OperationalError:  # databases created without a fingerprint
+            row = None
+        finally:
+            connection.close()
+        return None if row is None else row[0]
+
+    def __getstate__(self) -> dict:
+        # the connection cannot be pickled, it is opened again by __setstate__ (e.g. in the worker processes of TDA)
+        state = self.__dict__.copy()
+        del state["connection"]
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self.connection = sqlite3.connect(self.database_path)
+
+    def memory_report(self) -> str:
+        """
+        Return a description of the size of the database
+        """
+        rows = self.connection.execute(f'SELECT COUNT(*) FROM "{self.table}"').fetchone()[0]
+        size = os.path.getsize(self.database_path)
+        return f"Dataset stored in {self.database_path}: {size / 2 ** 20:.2f} MB on disk ({rows} rows)"
+
+    def _group_sum(self, columns: list[str]) -> pd.Series:
+        """
+        Return the flows summed by columns, as OD_tree._group_sum, with a GROUP BY executed by SQLite
+        :param columns: list[str], columns to group by
+        :return: pd.Series, flows indexed by columns
+        """
+        selected = ", ".join(f'"{column}"' for column in columns)
+        query = (f'SELECT {selected}, SUM("{self.flow_column}") FROM "{self.table}" '
+                 f'GROUP BY {selected} ORDER BY {selected}')
+        # fetch the aggregated rows in blocks, so that python tuples are never held for the whole level
+        cursor = self.connection.execute(query)
+        blocks = [np.zeros((0, len(columns) + 1), dtype=np.int64)]
+        while rows := cursor.fetchmany(2 ** 16):
+            blocks.append(np.array(rows, dtype=np.int64))
+        values = np.concatenate(blocks)
+        index = pd.MultiIndex.from_arrays([values[:, i].astype(np.int32) for i in range(len(columns))],
+                                          names=columns)
+        return pd.Series(values[:, -1], index=index, name=self.flow_column)
@@ -1,5 +1,83 @@
+import numpy as np
 import pandas as pd
+from typing import NamedTuple
 from .geospine import GeoSpine
+from .cache import AggregateCache, get_data_fingerprint
+
+
+class ChildIndex(NamedTuple):
+    """
+    Aggregated counts of the children of every parent pair of a level, sorted by (parent origin, parent destination,
+    child origin, child destination). The children of the parent pair parent_keys[i] (parent origin * number of
+    parent destinations + parent destination) are in positions [offsets[i], offsets[i + 1]).
+    """
+    parent_keys: np.ndarray
+    offsets: np.ndarray
+    orig: np.ndarray
+    dest: np.ndarray
+    counts: np.ndarray
+    columns: tuple[str, str]
+
+
+class ChildQuery(NamedTuple):
+    """
+    Children of a batch of parent pairs, zero-filled. The children of the k-th parent pair are in positions
+    [offsets[k], offsets[k + 1]) of values, orig and dest, in the same order of `OD_tree.full_child_query_level`.
+    """
+    values: np.ndarray
+    offsets: np.ndarray
+    orig: np.ndarray
+    dest: np.ndarray
+
+    def select(self, segments: np.ndarray) -> "ChildQuery":
+        """
+        Return the children of the parent pairs in positions segments of the batch, in the order of segments
+        """
+        sizes = np.diff(self.offsets)[segments]
+        offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=offsets[1:])
+        source = _concatenate_ranges(self.offsets[segments], sizes)
+        return ChildQuery(values=self.values[source], offsets=offsets, orig=self.orig[source], dest=self.dest[source])
+
+
+class SparseQuery(NamedTuple):
+    """
+    Query of a level that stores only the non-zero OD pairs, every other pair of the implicit dense shape
+    (number of origins, number of destinations) is zero. The pair (orig, dest) is in position orig * shape[1] + dest
+    of the dense query returned by `OD_tree.full_query_level`, pairs are sorted by position.
+    """
+    orig: np.ndarray
+    dest: np.ndarray
+    values: np.ndarray
+    shape: tuple[int, int]
+
+    def flat_index(self) -> np.ndarray:
+        """
+        Return the positions of the non-zero OD pairs in the dense query
+        """
+        return self.orig.astype(np.int64) * self.shape[1] + self.dest
+
+    def to_dense(self, start: int = 0, end: int = None) -> np.ndarray:
+        """
+        Return the values of the dense query in the positions [start, end), by default the whole query
+        """
+        if end is None:
+            end = self.shape[0] * self.shape[1]
+        # the non-zero OD pairs are sorted by position
+        positions = self.flat_index()
+        first, last = np.searchsorted(positions, [start, end])
+        dense = np.zeros(end - start, dtype=self.values.dtype)
+        dense[positions[first:last] - start] = self.values[first:last]
+        return dense
+
+
+def _concatenate_ranges(starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """
+    Return the concatenation of the ranges [starts[i], starts[i] + lengths[i])
+    """
+    total = int(lengths.sum())
+    ends = np.cumsum(lengths)
+    return np.arange(total, dtype=np.int64) + np.repeat(starts - (ends - lengths), lengths)
 
 
 class OD_tree:
@@ -10,27 +88,144 @@ class OD_tree:
                  orig_dest: tuple[str] = None,
                  flow_column: str = None,
                  mode: str = "destination",
-                 final_level: int = None):
+                 final_level: int = None,
+                 cache: AggregateCache = None):
+        """
+        :param data: pd.DataFrame, dataset with the origin and destination nodes at every level of the spine
+        :param spine: GeoSpine, hierarchy of the nodes
+        :param orig_dest: tuple[str], suffixes of the origin and destination columns
+        :param flow_column: str, column containing the flows
+        :param mode: str, split schedule of the tree:
+            - "destination": each level splits one side, starting from the destination (2 * final_level levels)
+            - "origin": each level splits one side, starting from the origin (2 * final_level levels)
+            - "joint": each level splits the origin and the destination together (final_level levels)
+        :param final_level: int, last level of the spine, by default the depth of the spine
+        :param cache: AggregateCache, on-disk store of the aggregates of the dataset, None to compute them
+        """
         if final_level is None:
             final_level = spine.depth
         if orig_dest is None:
             orig_dest = ("_ORIG", "_DEST")
         if flow_column is None:
             flow_column = "COUNT"
+        self._set_split_schedule(mode, final_level)
+        self.spine = spine
+        self.data = self._compact(data, orig_dest, flow_column)
+        self.orig_dest = orig_dest
+        self.flow_column = flow_column
+        self.cache = cache
+        # per-level sorted aggregates used by the child queries
+        self._child_index: dict[int, ChildIndex] = {}
+
+    def _set_split_schedule(self, mode: str, final_level: int):
+        """
+        Set the levels of the origin and destination nodes (od_to_level) and the split sides (_bool_od) of each level
+        of the tree, and the depth of the tree
+        :param mode: str, split schedule of the tree, see __init__
+        :param final_level: int, last level of the spine
+        """
         if mode == "destination":
+            # split the destination, then the origin: (0, 0), (0, 1), (1, 1), (1, 2), ...
             od_to_level = [(i, i) if i == j else (i, j) for i in range(final_level + 1) for j in range(i, i + 2)]
             bool_od = [(False, True) if i % 2 == 0 else (True, False) for i in range(final_level * 2)]
             # drop the last element
             od_to_level = od_to_level[:-1]
+            depth = 2 * final_level
+        elif mode == "origin":
+            # split the origin, then the destination: (0, 0), (1, 0), (1, 1), (2, 1), ...
+            od_to_level = [(i, i) if i == j else (j, i) for i in range(final_level + 1) for j in range(i, i + 2)]
+            bool_od = [(True, False) if i % 2 == 0 else (False, True) for i in range(final_level * 2)]
+            # drop the last element
+            od_to_level = od_to_level[:-1]
+            depth = 2 * final_level
+        elif mode == "joint":
+            # split the origin and the destination together: (0, 0), (1, 1), (2, 2), ...
+            od_to_level = [(i, i) for i in range(final_level + 1)]
+            bool_od = [(True, True) for _ in range(final_level)]
+            depth = final_level
         else:
             raise ValueError("Mode not recognized")
-        self.data = data
-        self.spine = spine
-        self.orig_dest = orig_dest
-        self.flow_column = flow_column
         self.od_to_level = od_to_level
         self._bool_od = bool_od
-        self.depth = 2 * final_level
+        self.mode = mode
+        self.depth = depth
+
+    def _compact(self, data: pd.DataFrame, orig_dest: tuple[str], flow_column: str) -> pd.DataFrame:
+        """
+        Normalize the dataset to a compact columnar layout:
+            - the nodes of the hierarchy columns (LEVEL<l><orig_dest>) are replaced with their int32 codes in the spine,
+              so that every groupby, filter and index of the tree works on dense integers. Use `decode_dataset` to
+              restore the nodes. Datasets loaded from the binary format (`load_dataset`) already contain the codes,
+              as recorded in data.attrs["encoded"], and are not copied if nothing needs to change
+            - the flow column is stored with the smallest signed integer type that holds its values (sums are
+              computed by pandas in int64)
+            - any other object column becomes categorical
+        The memory footprint before and after is stored in `memory_footprint`.
+        :param data: pd.DataFrame, dataset with the nodes
+        :param orig_dest: tuple[str], suffixes of the origin and destination columns
+        :param flow_column: str, column containing the flows
+        :return: pd.DataFrame, compact dataset with the codes
+        """
+        memory_before = int(data.memory_usage(index=True, deep=True).sum())
+        encoded = data.attrs.get("encoded", False)
+        compact_columns = {}
+        for level in range(self.spine.depth + 1):
+            for suffix in orig_dest:
+                column = "LEVEL" + str(level) + suffix
+                if column in data.columns:
+                    if not encoded:
+                        compact_columns[column] = self.spine.encode(level, data[column])
+                    elif data[column].dtype != np.int32:
+                        compact_columns[column] = data[column].astype(np.int32)
+        for column in data.columns:
+            if column == flow_column:
+                flows = pd.to_numeric(data[column], downcast="integer")
+                if flows.dtype != data[column].dtype:
+                    compact_columns[column] = flows
+            elif column not in compact_columns and data[column].dtype == object:
+                compact_columns[column] = data[column].astype("category")
+        if compact_columns:
+            data = data.assign(**compact_columns)
+        memory_after = int(data.memory_usage(index=True, deep=True).sum())
+        self.memory_footprint: dict[str, int] = {"before": memory_before, "after": memory_after}
+        return data
+
+    def memory_report(self) -> str:
+        """
+        Return a description of the memory footprint of the dataset before and after the normalization
+        """
+        before, after = self.memory_footprint["before"], self.memory_footprint["after"]
+        return (f"Dataset memory footprint: {before / 2 ** 20:.2f} MB -> {after / 2 ** 20:.2f} MB "
+                f"({len(self.data)} rows, {', '.join(f'{c}: {t}' for c, t in self.data.dtypes.items())})")
+
+    def _group_sum(self, columns: list[str]) -> pd.Series:
+        """
+        Return data.groupby(columns)[flow_column].sum(), the flows are summed with 64 bits as they are stored with the
+        smallest integer type
+        :param columns: list[str], columns to group by
+        :return: pd.Series, flows indexed by columns
+        """
+        flows = self.data[self.flow_column]
+        flows = flows.astype(np.result_type(flows.dtype, np.int64))
+        return flows.groupby([self.data[column] for column in columns]).sum()
+
+    def _aggregate(self, columns: list[str]) -> pd.Series:
+        """
+        Return the flows summed by columns with `_group_sum`, read from the cache if it contains them
+        :param columns: list[str], columns to group by
+        :return: pd.Series, flows indexed by columns
+        """
+        if self.cache is None:
+            return self._group_sum(columns)
+        name = "sum_" + "_".join(columns)
+        arrays = self.cache.load(name)
+        if arrays is None:
+            query = self._group_sum(columns)
+            arrays = {column: query.index.get_level_values(i).to_numpy() for i, column in enumerate(columns)}
+            self.cache.save(name, dict(arrays, **{self.flow_column: query.to_numpy()}))
+            return query
+        index = pd.MultiIndex.from_arrays([arrays[column] for column in columns], names=columns)
+        return pd.Series(arrays[self.flow_column], index=index, name=self.flow_column)
 
     def _get_od_levels(self, level: int) -> tuple[int, int]:
         """
@@ -38,14 +233,49 @@ class OD_tree:
         :param od: tuple[int, int], origin and destination nodes
         :return: tuple[int, int], levels of the origin and destination nodes
         """
+        self.check_level(level)
         return self.od_to_level[level]
 
+    def get_fingerprint(self) -> str:
+        """
+        Return a hash of the flows of the dataset at the final level and of the spine, e.g. to tell whether a
+        checkpoint belongs to the same dataset
+        :return: str, hexadecimal digest
+        """
+        return get_data_fingerprint(self.get_data_at_level(self.depth), self.spine)
+
+    def check_level(self, level: int):
+        """
+        Raise a ValueError if the tree has no such level. The number of levels depends on the split schedule (mode)
+        :param level: int, level of the tree
+        """
+        if not 0 <= level <= self.depth:
+            raise ValueError(f"Level {level} is not a level of the tree: with mode '{self.mode}' the levels go from 0 "
+                             f"to {self.depth}")
+
+    def get_geo_level(self, level: int) -> int:
+        """
+        Get the level of the spine used to release the data at a level of the tree, i.e. the lowest of the levels of
+        the origin and destination nodes
+        :param level: int, level of the tree
+        :return: int, level of the spine
+        """
+        return min(self._get_od_levels(level))
+
+    def get_budget_rounds(self, final_level: int) -> int:
+        """
+        Get the number of shares of the privacy budget of a release up to a level, one for each level released. The
+        destination schedule keeps the split of the original TDA, over twice the final level
+        :param final_level: int, final level of the release
+        :return: int, number of shares
+        """
+        return final_level * 2 if self.mode == "destination" else final_level
+
     def get_data_at_level(self, level: int) -> pd.DataFrame:
         od_level: tuple = self._get_od_levels(level)
-        df = self.data
         orig_column = ["LEVEL" + str(x) + self.orig_dest[0] for x in range(od_level[0] + 1)]
         dest_column = ["LEVEL" + str(x) + self.orig_dest[1] for x in range(od_level[1] + 1)]
-        return df.groupby(orig_column + dest_column, as_index=False)[self.flow_column].sum()
+        return self._aggregate(orig_column + dest_column).reset_index()
 
     def stable_query_level(self, level: int) -> pd.Series:
         """
@@ -55,11 +285,10 @@ class OD_tree:
         """
 
         # get the data at the level
-        df = self.data
         od_level: tuple = self._get_od_levels(level)
         orig_column = "LEVEL" + str(od_level[0]) + self.orig_dest[0]
         dest_column = "LEVEL" + str(od_level[1]) + self.orig_dest[1]
-        query = df.groupby([orig_column] + [dest_column])[self.flow_column].sum()
+        query = self._aggregate([orig_column] + [dest_column])
         return query
 
     def full_query_level(self, level: int) -> pd.Series:
@@ -71,41 +300,122 @@ class OD_tree:
         od_level: tuple = self._get_od_levels(level)
         stable_data = self.stable_query_level(level)
         # get all possible OD pairs from spine
-        orig_nodes = self.spine.get_nodes(level=od_level[0])
-        dest_nodes = self.spine.get_nodes(level=od_level[1])
-        all_nodes = [(orig, dest) for orig in orig_nodes for dest in dest_nodes]
+        orig_nodes = np.arange(self.spine.level_size(level=od_level[0]), dtype=np.int32)
+        dest_nodes = np.arange(self.spine.level_size(level=od_level[1]), dtype=np.int32)
+        all_nodes = pd.MultiIndex.from_product([orig_nodes, dest_nodes], names=stable_data.index.names)
         # reindex stable data by adding zero
         query = stable_data.reindex(all_nodes, fill_value=0)
         return query
 
-    def stable_child_query_level(self, level: int, nodes: tuple[any, any]) -> pd.Series:
+    def sparse_query_level(self, level: int) -> SparseQuery:
         """
-        Return the attributes of the children of a node, only return non-zero values
-        :param nodes:
-        :param level:
-        :return:
+        Query the level of the tree, return the non-zero OD pairs and the shape of the full query, without
+        materializing all the possible OD pairs
+        :param level: int, level to query
+        :return: SparseQuery, data at the level
+        """
+        od_level: tuple = self._get_od_levels(level)
+        stable_data = self.stable_query_level(level)
+        stable_data = stable_data[stable_data != 0]
+        shape = (self.spine.level_size(level=od_level[0]), self.spine.level_size(level=od_level[1]))
+        return SparseQuery(orig=stable_data.index.get_level_values(0).to_numpy().astype(np.int32),
+                           dest=stable_data.index.get_level_values(1).to_numpy().astype(np.int32),
+                           values=stable_data.to_numpy(),
+                           shape=shape)
+
+    def _get_child_index(self, level: int) -> ChildIndex:
+        """
+        Return the aggregated counts of the children of every parent pair at the level, computed at the first call
+        :param level: int, level of the parents
+        :return: ChildIndex, sorted counts and offsets of the level
+        """
+        if level not in self._child_index:
+            # the child index depends only on the levels of the parents and of the children
+            name = "children_{}_{}_{}_{}".format(*self._get_od_levels(level), *self._get_od_levels(level + 1))
+            arrays = self.cache.load(name) if self.cache is not None else None
+            if arrays is None:
+                child_index = self._build_child_index(level)
+                if self.cache is not None:
+                    self.cache.save(name, dict(child_index._asdict(), columns=np.array(child_index.columns)))
+            else:
+                child_index = ChildIndex(**dict(arrays, columns=tuple(arrays["columns"].tolist())))
+            self._child_index[level] = child_index
+        return self._child_index[level]
+
+    def _build_child_index(self, level: int) -> ChildIndex:
+        """
+        Aggregate the data at level + 1 with a single groupby and sort it by (parent origin, parent destination,
+        child origin, child destination), so that the children of each parent pair are a contiguous slice
+        :param level: int, level of the parents
+        :return: ChildIndex
         """
-        df = self.data
         od_level: tuple = self._get_od_levels(level)
         bool_od = self._bool_od[level]
-        orig_node, dest_node = nodes
-        # get the children
+        child_od_level: tuple = self._get_od_levels(level + 1)
+        orig_column = "LEVEL" + str(child_od_level[0]) + self.orig_dest[0]
+        dest_column = "LEVEL" + str(child_od_level[1]) + self.orig_dest[1]
+        query = self._aggregate([orig_column, dest_column])
+        orig = query.index.get_level_values(0).to_numpy().astype(np.int32)
+        dest = query.index.get_level_values(1).to_numpy().astype(np.int32)
+        counts = query.to_numpy()
+        # get the parents of each child pair
+        parent_orig = self.spine.get_father_codes(child_od_level[0], orig) if bool_od[0] else orig
+        parent_dest = self.spine.get_father_codes(child_od_level[1], dest) if bool_od[1] else dest
+        parent_keys = parent_orig.astype(np.int64) * self.spine.level_size(od_level[1]) + parent_dest
+        # sort and compute the offsets of each parent pair
+        order = np.lexsort((dest, orig, parent_keys))
+        parent_keys = parent_keys[order]
+        unique_keys, starts = np.unique(parent_keys, return_index=True)
+        offsets = np.append(starts, len(parent_keys)).astype(np.int64)
+        return ChildIndex(parent_keys=unique_keys, offsets=offsets, orig=orig[order], dest=dest[order],
+                          counts=counts[order], columns=(orig_column, dest_column))
+
+    def _get_child_slice(self, level: int, nodes: tuple[any, any]) -> slice:
+        """
+        Return the slice of the ChildIndex of the level containing the children of a parent pair
+        :param level: int, level of the parents
+        :param nodes: tuple, (origin code, destination code) of the parent pair
+        """
+        child_index = self._get_child_index(level)
+        od_level: tuple = self._get_od_levels(level)
+        key = int(nodes[0]) * self.spine.level_size(od_level[1]) + int(nodes[1])
+        i = np.searchsorted(child_index.parent_keys, key)
+        if i < len(child_index.parent_keys) and child_index.parent_keys[i] == key:
+            return slice(child_index.offsets[i], child_index.offsets[i + 1])
+        return slice(0, 0)
+
+    def _get_children_range(self, level: int, nodes: tuple[any, any]) -> tuple[int, int, int, int]:
+        """
+        Return the ranges [orig_start, orig_end) and [dest_start, dest_end) of the codes of the children of a parent
+        pair, the side that is not split keeps the parent node
+        :param level: int, level of the parents
+        :param nodes: tuple, (origin code, destination code) of the parent pair
+        """
+        od_level: tuple = self._get_od_levels(level)
+        bool_od = self._bool_od[level]
+        orig_node, dest_node = int(nodes[0]), int(nodes[1])
         if bool_od[0]:
-            orig_node_children = self.spine.get_children(level=od_level[0], father_node=orig_node)
+            orig_start, orig_end = self.spine.get_children_range(level=od_level[0], father_code=orig_node)
         else:
-            orig_node_children = [orig_node]
+            orig_start, orig_end = orig_node, orig_node + 1
         if bool_od[1]:
-            dest_node_children = self.spine.get_children(level=od_level[1], father_node=dest_node)
+            dest_start, dest_end = self.spine.get_children_range(level=od_level[1], father_code=dest_node)
         else:
-            dest_node_children = [dest_node]
-        # get attributes
-        od_level: tuple = self._get_od_levels(level + 1)
-        orig_column = "LEVEL" + str(od_level[0]) + self.orig_dest[0]
-        dest_column = "LEVEL" + str(od_level[1]) + self.orig_dest[1]
-        query = df[df[orig_column].isin(orig_node_children) & df[dest_column].isin(dest_node_children)][
-            [orig_column, dest_column, self.flow_column]]
-        query = query.groupby([orig_column, dest_column])[self.flow_column].sum()
-        return query
+            dest_start, dest_end = dest_node, dest_node + 1
+        return int(orig_start), int(orig_end), int(dest_start), int(dest_end)
+
+    def stable_child_query_level(self, level: int, nodes: tuple[any, any]) -> pd.Series:
+        """
+        Return the attributes of the children of a node, only return non-zero values
+        :param nodes:
+        :param level:
+        :return:
+        """
+        child_index = self._get_child_index(level)
+        child_slice = self._get_child_slice(level, nodes)
+        index = pd.MultiIndex.from_arrays([child_index.orig[child_slice], child_index.dest[child_slice]],
+                                          names=child_index.columns)
+        return pd.Series(child_index.counts[child_slice], index=index, name=self.flow_column)
 
     def full_child_query_level(self, level: int, nodes: tuple[any, any]) -> pd.Series:
         """
@@ -113,28 +423,82 @@ class OD_tree:
         :param level:
         :return:
         """
+        child_index = self._get_child_index(level)
+        child_slice = self._get_child_slice(level, nodes)
+        orig_start, orig_end, dest_start, dest_end = self._get_children_range(level, nodes)
+        # zero-fill the cartesian product of the children, children are stored in the same order
+        number_of_dest = dest_end - dest_start
+        values = np.zeros((orig_end - orig_start) * number_of_dest, dtype=child_index.counts.dtype)
+        positions = ((child_index.orig[child_slice] - orig_start) * number_of_dest +
+                     (child_index.dest[child_slice] - dest_start))
+        values[positions] = child_index.counts[child_slice]
+        index = pd.MultiIndex.from_product([np.arange(orig_start, orig_end, dtype=np.int32),
+                                            np.arange(dest_start, dest_end, dtype=np.int32)],
+                                           names=child_index.columns)
+        return pd.Series(values, index=index, name=self.flow_column)
+
+    def sparse_child_query_level(self, level: int, nodes: tuple[any, any]) -> tuple[np.ndarray, np.ndarray, int]:
+        """
+        Return the non-zero children of a node as positions in the vector of `full_child_query_level`, without
+        zero-filling it
+        :param level: int, level of the parents
+        :param nodes: tuple, (origin code, destination code) of the parent pair
+        :return: sorted positions and values of the non-zero children, and the number of children
+        """
+        child_index = self._get_child_index(level)
+        child_slice = self._get_child_slice(level, nodes)
+        orig_start, orig_end, dest_start, dest_end = self._get_children_range(level, nodes)
+        number_of_dest = dest_end - dest_start
+        positions = ((child_index.orig[child_slice].astype(np.int64) - orig_start) * number_of_dest +
+                     (child_index.dest[child_slice] - dest_start))
+        return positions, child_index.counts[child_slice], (orig_end - orig_start) * number_of_dest
+
+    def full_child_query_level_batch(self, level: int, nodes: tuple[np.ndarray, np.ndarray]) -> ChildQuery:
+        """
+        Return the attributes of the children of a batch of nodes, as `full_child_query_level` for each of them but
+        with a fixed number of NumPy calls
+        :param level: int, level of the parents
+        :param nodes: tuple[np.ndarray, np.ndarray], origin codes and destination codes of the parent pairs
+        :return: ChildQuery, flat values, segment offsets and codes of the children
+        """
+        child_index = self._get_child_index(level)
         od_level: tuple = self._get_od_levels(level)
         bool_od = self._bool_od[level]
-        orig_node, dest_node = nodes
-        # get the children
+        parent_orig = np.asarray(nodes[0], dtype=np.int64)
+        parent_dest = np.asarray(nodes[1], dtype=np.int64)
+        # get the ranges of the children
         if bool_od[0]:
-            orig_node_children = self.spine.get_children(level=od_level[0], father_node=orig_node)
+            orig_start, orig_end = self.spine.get_children_range(level=od_level[0], father_code=parent_orig)
         else:
-            orig_node_children = [orig_node]
+            orig_start, orig_end = parent_orig, parent_orig + 1
         if bool_od[1]:
-            dest_node_children = self.spine.get_children(level=od_level[1], father_node=dest_node)
+            dest_start, dest_end = self.spine.get_children_range(level=od_level[1], father_code=parent_dest)
         else:
-            dest_node_children = [dest_node]
-        # get all possible OD pairs from spine
-        all_nodes = [(orig, dest) for orig in orig_node_children for dest in dest_node_children]
-        # get stable query
-        stable_data = self.stable_child_query_level(level, nodes)
-        # reindex stable data by adding zero
-        query = stable_data.reindex(all_nodes, fill_value=0)
-        return query
+            dest_start, dest_end = parent_dest, parent_dest + 1
+        number_of_dest = dest_end - dest_start
+        sizes = (orig_end - orig_start) * number_of_dest
+        offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=offsets[1:])
+        # cartesian product of the children of each parent pair
+        segment = np.repeat(np.arange(len(sizes)), sizes)
+        local = np.arange(offsets[-1], dtype=np.int64) - offsets[segment]
+        orig = (orig_start[segment] + local // number_of_dest[segment]).astype(np.int32)
+        dest = (dest_start[segment] + local % number_of_dest[segment]).astype(np.int32)
+        # zero-fill, then scatter the non-zero children of each parent pair
+        values = np.zeros(offsets[-1], dtype=child_index.counts.dtype)
+        keys = parent_orig * self.spine.level_size(od_level[1]) + parent_dest
+        i = np.searchsorted(child_index.parent_keys, keys)
+        found = i < len(child_index.parent_keys)
+        found[found] = child_index.parent_keys[i[found]] == keys[found]
+        starts = np.where(found, child_index.offsets[np.minimum(i, len(child_index.offsets) - 2)], 0)
+        lengths = np.where(found, child_index.offsets[np.minimum(i + 1, len(child_index.offsets) - 1)] - starts, 0)
+        source = _concatenate_ranges(starts, lengths)
+        segment = np.repeat(np.arange(len(sizes)), lengths)
+        positions = (offsets[segment] + (child_index.orig[source] - orig_start[segment]) * number_of_dest[segment] +
+                     (child_index.dest[source] - dest_start[segment]))
+        values[positions] = child_index.counts[source]
+        return ChildQuery(values=values, offsets=offsets, orig=orig, dest=dest)
 
     def get_number_of_nodes(self, level: int) -> int:
         od_level: tuple = self._get_od_levels(level)
-        orig_nodes = self.spine.get_nodes(level=od_level[0])
-        dest_nodes = self.spine.get_nodes(level=od_level[1])
-        return len(orig_nodes) * len(dest_nodes)
\ No newline at end of file
+        return self.spine.level_size(level=od_level[0]) * self.spine.level_size(level=od_level[1])
@@ -1,4 +1,8 @@
 from .geospine import GeoSpine
+import os
+import re
+import pickle
+import numpy as np
 import pandas as pd
 
 
@@ -9,30 +13,175 @@ def get_dataset_from_dict(data_dict: dict,
     WORKS ONLY FOR EVEN FINAL LEVEL
 
     Get a dataset from a dictionary
-    :param data_dict: dict, dictionary with the data
+    :param data_dict: dict, dictionary with the data, keys are (origin code, destination code) at geo_level
     :param spine: GeoSpine, spine of the dataset
     :param geo_level: int, final level of the geo partition
 
-    :return: pd.DataFrame, dataset
-    """
-    data_to_add = []
-    # compute all the possible paths, so the set of the nodes in the first and second keys
-    all_nodes = set()
-    for nodes in data_dict.keys():
-        all_nodes.add(nodes[0])
-        all_nodes.add(nodes[1])
-    path_dict = {}
-    for node in all_nodes:
-        path = spine.get_path(level=geo_level, node=node)
-        path_dict[node] = path
-
-    # get origin, destination and flow
-    for nodes, value in data_dict.items():
-        orig_node = nodes[0]
-        dest_node = nodes[1]
-        data_to_add.append(path_dict[orig_node] + path_dict[dest_node] + (value,))
-
-    orig_column = tuple(["LEVEL" + str(level) + "_ORIG" for level in range(geo_level + 1)])
-    dest_column = tuple(["LEVEL" + str(level) + "_DEST" for level in range(geo_level + 1)])
-    dataset = pd.DataFrame(data_to_add, columns=orig_column + dest_column + ("COUNT",))
+    :return: pd.DataFrame, dataset with the codes of the nodes (see `decode_dataset`)
+    """
+    keys = np.array(list(data_dict.keys()), dtype=np.int64).reshape(-1, 2)
+    return get_dataset_from_arrays(orig=keys[:, 0],
+                                   dest=keys[:, 1],
+                                   values=np.array(list(data_dict.values())),
+                                   spine=spine,
+                                   geo_level=geo_level)
+
+
+def get_dataset_from_arrays(orig: np.ndarray,
+                            dest: np.ndarray,
+                            values: np.ndarray,
+                            spine: GeoSpine,
+                            geo_level: int) -> pd.DataFrame:
+    """
+    WORKS ONLY FOR EVEN FINAL LEVEL
+
+    Get a dataset from parallel arrays, as `get_dataset_from_dict`
+    :param orig: np.ndarray, origin codes at geo_level
+    :param dest: np.ndarray, destination codes at geo_level
+    :param values: np.ndarray, flows
+    :param spine: GeoSpine, spine of the dataset
+    :param geo_level: int, final level of the geo partition
+
+    :return: pd.DataFrame, dataset with the codes of the nodes (see `decode_dataset`)
+    """
+    orig_column = ["LEVEL" + str(level) + "_ORIG" for level in range(geo_level + 1)]
+    dest_column = ["LEVEL" + str(level) + "_DEST" for level in range(geo_level + 1)]
+    if len(values) == 0:
+        return pd.DataFrame(columns=orig_column + dest_column + ["COUNT"])
+
+    # codes are positions in the spine, so the paths are rows of the ancestor matrix
+    orig_paths = spine.get_ancestor_positions(level=geo_level, positions=orig).astype(np.int32)
+    dest_paths = spine.get_ancestor_positions(level=geo_level, positions=dest).astype(np.int32)
+
+    columns = {column: orig_paths[:, level] for level, column in enumerate(orig_column)}
+    columns.update({column: dest_paths[:, level] for level, column in enumerate(dest_column)})
+    columns["COUNT"] = values
+    dataset = pd.DataFrame(columns)
     return dataset
+
+
+def decode_dataset(dataset: pd.DataFrame, spine: GeoSpine) -> pd.DataFrame:
+    """
+    Replace the codes of the hierarchy columns (LEVEL<l>_ORIG, LEVEL<l>_DEST, ...) with the nodes of the spine.
+    It is the inverse of the encoding done by OD_tree, to be used only when a dataset is exported.
+    :param dataset: pd.DataFrame, dataset with the codes
+    :param spine: GeoSpine, spine of the dataset
+
+    :return: pd.DataFrame, dataset with the nodes
+    """
+    decoded_columns = {}
+    for column in dataset.columns:
+        match = re.match(r"LEVEL(\d+)_", column)
+        if match is not None:
+            decoded_columns[column] = spine.decode(int(match.group(1)), dataset[column].values)
+    return dataset.assign(**decoded_columns).infer_objects()
+
+
+def save_dataset(dataset: pd.DataFrame,
+                 folder_path: str,
+                 spine: GeoSpine,
+                 orig_dest: tuple[str] = ("_ORIG", "_DEST"),
+                 flow_column: str = "COUNT") -> None:
+    """
+    Save a dataset in the columnar binary format, one .npy file for each column and `columns.npy` with their order.
+    The hierarchy columns (LEVEL<l><orig_dest>) are stored with the int32 codes of their nodes in the spine and the
+    flow column with the smallest signed integer type that holds its values, so the dataset can be memory-mapped by
+    `load_dataset` and used by OD_tree without parsing or encoding.
+    :param dataset: pd.DataFrame, dataset with the nodes
+    :param folder_path: str, folder where to save the dataset
+    :param spine: GeoSpine, spine of the dataset
+    :param orig_dest: tuple[str], suffixes of the origin and destination columns
+    :param flow_column: str, column containing the flows
+    """
+    os.makedirs(folder_path, exist_ok=True)
+    for column in dataset.columns:
+        match = re.match(r"LEVEL(\d+)(.*)", column)
+        if match is not None and match.group(2) in orig_dest:
+            values = spine.encode(int(match.group(1)), dataset[column])
+        elif column == flow_column:
+            values = pd.to_numeric(dataset[column], downcast="integer").to_numpy()
+        elif dataset[column].dtype == object:
+            values = dataset[column].to_numpy(dtype=str)
+        else:
+            values = dataset[column].to_numpy()
+        np.save(os.path.join(folder_path, column + ".npy"), values, allow_pickle=False)
+    np.save(os.path.join(folder_path, "columns.npy"), np.array(dataset.columns, dtype=str))
+
+
+def load_dataset(folder_path: str, mmap_mode: str = "r") -> pd.DataFrame:
+    """
+    Load a dataset. The columnar binary format (folder `data`, see `save_dataset`) is preferred: the columns are
+    memory-mapped without copies and the hierarchy columns contain the codes of the nodes, which is recorded in
+    `dataset.attrs["encoded"]` for OD_tree. If it is missing the dataset is read from `data.csv`.
+    :param folder_path: str, folder of the dataset
+    :param mmap_mode: str, memory-map mode of the binary format, None to read the columns in memory
+
+    :return: pd.DataFrame, the dataset
+    """
+    binary_path = os.path.join(folder_path, "data")
+    if not os.path.isdir(binary_path):
+        return pd.read_csv(os.path.join(folder_path, "data.csv"))
+    columns = np.load(os.path.join(binary_path, "columns.npy")).tolist()
+    dataset = pd.DataFrame({column: np.load(os.path.join(binary_path, column + ".npy"), mmap_mode=mmap_mode)
+                            for column in columns}, copy=False)
+    dataset.attrs["encoded"] = True
+    return dataset
+
+
+def get_dataset_files(folder_path: str) -> list[str]:
+    """
+    Return the files read by `load_dataset`: the columns of the binary format, or `data.csv` if it is missing
+    :param folder_path: str, folder of the dataset
+    """
+    binary_path = os.path.join(folder_path, "data")
+    if not os.path.isdir(binary_path):
+        return [os.path.join(folder_path, "data.csv")]
+    return [os.path.join(binary_path, file) for file in sorted(os.listdir(binary_path)) if file.endswith(".npy")]
+
+
+def convert_csv_to_dataset(csv_path: str, folder_path: str, spine: GeoSpine) -> None:
+    """
+    Convert a dataset saved as CSV into the columnar binary format
+    :param csv_path: str, path of the CSV file
+    :param folder_path: str, folder where to save the dataset
+    :param spine: GeoSpine, spine of the dataset
+    """
+    save_dataset(pd.read_csv(csv_path), folder_path, spine)
+
+
+def load_spine(structure_path: str, mmap_mode: str = "r") -> GeoSpine:
+    """
+    Load the spine of a dataset. The binary format (folder `geo_spine`) is preferred, if it is missing the spine is
+    read from `geo_spine.pickle`.
+    :param structure_path: str, the `structure` folder of the dataset
+    :param mmap_mode: str, memory-map mode of the binary format, None to read the arrays in memory
+
+    :return: GeoSpine, spine of the dataset
+    """
+    binary_path = os.path.join(structure_path, "geo_spine")
+    if os.path.isdir(binary_path):
+        return GeoSpine.load(binary_path, mmap_mode=mmap_mode)
+    with open(os.path.join(structure_path, "geo_spine.pickle"), "rb") as f:
+        return GeoSpine(pickle.load(f))
+
+
+def convert_pickle_to_spine(pickle_path: str, folder_path: str) -> None:
+    """
+    Convert a spine saved as a pickled nested dictionary into the binary format
+    :param pickle_path: str, path of the pickle file
+    :param folder_path: str, folder where to save the binary spine
+    """
+    with open(pickle_path, "rb") as f:
+        spine = GeoSpine(pickle.load(f))
+    spine.save(folder_path)
+
+
+def convert_spine_to_pickle(folder_path: str, pickle_path: str) -> None:
+    """
+    Convert a spine saved in the binary format into a pickled nested dictionary
+    :param folder_path: str, folder containing the binary spine
+    :param pickle_path: str, path of the pickle file
+    """
+    spine = GeoSpine.load(folder_path)
+    with open(pickle_path, "wb") as f:
+        pickle.dump(spine.original_spine, f, protocol=pickle.HIGHEST_PROTOCOL)
@@ -1,6 +1,9 @@
 from .gaussian_mechanism import gaussian_mechanism, make_gaussian_noise
 from .stability_histogram import stability_histogram, make_stability_histogram
 from .utils import get_rho_from_budget
+from .discrete_gaussian import sample_discrete_gaussian, sample_discrete_laplace, make_keyed_gaussian_noise, \
+    KeyedGaussianNoise, make_buffered_gaussian_noise, BufferedGaussianNoise, check_gaussian_calibration, \
+    DiscreteGaussianTail
 from opendp.prelude import enable_features
 
 enable_features("contrib", "floating-point")
\ No newline at end of file
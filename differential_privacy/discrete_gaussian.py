@@ -0,0 +1,252 @@
+from functools import cached_property
+from typing import Union
+
+import numpy as np
+
+
+def sample_discrete_gaussian(scale: float, size: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Sample from the discrete Gaussian distribution centered in zero, P(x) proportional to exp(-x^2 / (2 scale^2)) on
+    the integers, with the rejection sampler of Canonne, Kamath and Steinke (2020) from the discrete Laplace
+    distribution. All the samples are drawn together, the rejected ones are drawn again.
+    Unlike OpenDP, the acceptance probabilities are computed in floating point.
+    :param scale: float, scale (sigma) of the distribution
+    :param size: int, number of samples
+    :param rng: np.random.Generator, source of randomness
+    :return: np.ndarray of int64 samples
+    """
+    samples = np.zeros(size, dtype=np.int64)
+    if scale == 0:
+        return samples
+    t = np.floor(scale) + 1
+    missing = np.arange(size)
+    while len(missing) > 0:
+        y = sample_discrete_laplace(t, len(missing), rng)
+        # accept with probability exp(-(|y| - scale^2 / t)^2 / (2 scale^2))
+        accept = rng.random(len(missing)) < np.exp(-(np.abs(y) - scale ** 2 / t) ** 2 / (2 * scale ** 2))
+        samples[missing[accept]] = y[accept]
+        missing = missing[~accept]
+    return samples
+
+
+def sample_discrete_laplace(scale: float, size: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Sample from the discrete Laplace distribution centered in zero, P(x) proportional to exp(-|x| / scale) on the
+    integers, as the difference of two geometric distributions
+    :param scale: float, scale of the distribution
+    :param size: int, number of samples
+    :param rng: np.random.Generator, source of randomness
+    :return: np.ndarray of int64 samples
+    """
+    if scale == 0:
+        return np.zeros(size, dtype=np.int64)
+    p = 1 - np.exp(-1 / scale)
+    return rng.geometric(p, size) - rng.geometric(p, size)
+
+
+class DiscreteGaussianTail:
+    """
+    Probabilities of the discrete Gaussian tabulated on [-bound, bound], the mass outside is below the precision of
+    float64. It samples the noise of many zero values at once: only the values whose noise falls in an interval are
+    drawn, with the exact conditional distribution, the others are known to be outside of it.
+    """
+
+    def __init__(self, scale: float):
+        """
+        :param scale: float, scale (sigma) of the discrete Gaussian
+        """
+        self.scale = scale
+        self.bound = int(np.ceil(12 * scale)) + 1
+        support = np.arange(-self.bound, self.bound + 1)
+        pmf = np.exp(-support.astype(float) ** 2 / (2 * scale ** 2)) if scale > 0 else (support == 0).astype(float)
+        self.pmf = pmf / pmf.sum()
+        # survival[i] = P(Z > i - bound), summed from the tail to keep the precision of the small probabilities
+        self.survival = np.append(np.cumsum(self.pmf[::-1])[::-1][1:], 0)
+
+    def get_cutoff(self, size: int, expected: float) -> int:
+        """
+        Return the smallest non-negative cutoff such that on average at most expected of size values exceed it
+        """
+        if size == 0:
+            return 0
+        i = np.searchsorted(-self.survival[self.bound:], -expected / size)
+        return int(min(i, self.bound))
+
+    def reveal(self, size: int, lower: float, upper: int, rng: np.random.Generator) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Sample the noise of size values conditioned on being <= upper and return the ones that are > lower, the noise of
+        the other values is <= lower
+        :param size: int, number of values
+        :param lower: float, lower end of the interval, may be -np.inf
+        :param upper: int, upper end of the interval, values are known to be <= upper
+        :param rng: np.random.Generator, source of randomness
+        :return: sorted indices in [0, size) of the revealed values and their noise
+        """
+        start = int(max(np.floor(lower) + 1, -self.bound)) + self.bound
+        end = int(min(upper, self.bound)) + self.bound + 1
+        if size == 0 or start >= end:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        cumulative = np.cumsum(self.pmf[start:end])
+        p = min(cumulative[-1] / (1 - self.survival[end - 1]), 1)
+        count = rng.binomial(size, p)
+        indices = np.sort(rng.choice(size, count, replace=False)).astype(np.int64)
+        # inverse of the distribution function restricted to the interval
+        u = rng.random(count) * cumulative[-1]
+        values = np.minimum(np.searchsorted(cumulative, u, side="right"), end - start - 1) + start - self.bound
+        return indices, values.astype(np.int64)
+
+
+class BufferedGaussianNoise:
+    """
+    Discrete Gaussian noise drawn in blocks: the samples are drawn block_size at a time in a preallocated int64 buffer
+    and each call takes the next slice, so a call with a few values costs a slice and an addition instead of a call
+    to OpenDP and the conversion of the values to and from a python list.
+    """
+
+    def __init__(self, scale: float, block_size: int = 2 ** 16, seed: int = None):
+        """
+        :param scale: float, scale (sigma) of the discrete Gaussian
+        :param block_size: int, number of samples drawn at a time
+        :param seed: int, seed of the generator, by default fresh entropy from the operating system
+        """
+        self.scale = scale
+        self.rng = np.random.default_rng(seed)
+        self.buffer = np.zeros(block_size, dtype=np.int64)
+        # position of the next unused sample of the buffer
+        self.position = block_size
+
+    @cached_property
+    def tail(self) -> DiscreteGaussianTail:
+        return DiscreteGaussianTail(self.scale)
+
+    def take(self, size: int) -> np.ndarray:
+        """
+        Return the next size samples, each sample is returned once
+        :param size: int, number of samples
+        :return: np.ndarray of int64 samples, a copy
+        """
+        if size > len(self.buffer):
+            return sample_discrete_gaussian(self.scale, size, self.rng)
+        if self.position + size > len(self.buffer):
+            # the unused samples of the last block are discarded, the samples are independent
+            self.buffer[:] = sample_discrete_gaussian(self.scale, len(self.buffer), self.rng)
+            self.position = 0
+        samples = self.buffer[self.position:self.position + size].copy()
+        self.position += size
+        return samples
+
+    def __call__(self, values: np.ndarray) -> np.ndarray:
+        """
+        Return the noisy values
+        :param values: np.ndarray, true values
+        """
+        return np.asarray(values, dtype=np.int64) + self.take(len(values))
+
+
+def check_gaussian_calibration(noise: BufferedGaussianNoise, d_in: Union[int, float], budget: float,
+                               size: int = 10 ** 5):
+    """
+    Check the calibration of a buffered noise against OpenDP: the OpenDP Gaussian measurement with the scale of the
+    noise must spend the budget, and the variance of size samples of the noise must be the one of the samples of the
+    measurement, up to 5 standard errors. Raise ValueError otherwise
+    :param noise: BufferedGaussianNoise, noise to check
+    :param d_in: l2 sensitivity
+    :param budget: privacy budget (rho in zCDP)
+    :param size: int, number of samples compared
+    """
+    from .gaussian_mechanism import make_gaussian_noise
+    measurement = make_gaussian_noise(d_in=d_in, budget=budget, dtype=int)
+    # the integer domain maps only integer distances, rho grows with the square of the sensitivity
+    rho = measurement.map(1) * d_in ** 2
+    if not np.isclose(rho, budget):
+        raise ValueError(f"OpenDP spends {rho} with the scale of the noise, not {budget}")
+    native = noise.take(size).astype(float)
+    reference = np.array(measurement(np.zeros(size, dtype=np.int64))).astype(float)
+    # 5 standard errors of the difference of the means and of the variances, for a distribution close to the normal
+    mean_error = 5 * np.sqrt(2 / size) * (noise.scale + 1)
+    var_error = 5 * np.sqrt(2 / size) * (native.var() + reference.var()) + 1e-9
+    if abs(native.mean() - reference.mean()) > mean_error or abs(native.var() - reference.var()) > var_error:
+        raise ValueError(f"The noise does not match OpenDP: variance {native.var():.3f} and mean {native.mean():.3f}, "
+                         f"OpenDP {reference.var():.3f} and {reference.mean():.3f}")
+
+
+def make_buffered_gaussian_noise(d_in: Union[int, float], budget: float, block_size: int = 2 ** 16, seed: int = None,
+                                 check: bool = False) -> BufferedGaussianNoise:
+    """
+    Return a buffered discrete Gaussian noise with rho (from zCDP), with the same scale of `make_gaussian_noise`
+    :param d_in: l2 sensitivity
+    :param budget: privacy budget (rho in zCDP)
+    :param block_size: int, number of samples drawn at a time
+    :param seed: int, seed of the generator, by default fresh entropy from the operating system
+    :param check: bool, check the calibration against OpenDP with `check_gaussian_calibration`
+    :return: BufferedGaussianNoise
+    """
+    assert budget > 0, f"Invalid budget: {budget}, must be > 0"
+    noise = BufferedGaussianNoise(scale=d_in / np.sqrt(2 * budget), block_size=block_size, seed=seed)
+    if check:
+        check_gaussian_calibration(noise, d_in, budget)
+    return noise
+
+
+class KeyedGaussianNoise:
+    """
+    Discrete Gaussian noise drawn from a counter-based generator (Philox) keyed by (seed, level, origin, destination):
+    the noise of the children of a parent pair depends only on the seed of the run and on the parent, so a release is
+    reproducible however its parents are split in chunks, processes or machines.
+    """
+
+    def __init__(self, scale: float, seed: int, level: int):
+        """
+        :param scale: float, scale (sigma) of the discrete Gaussian
+        :param seed: int, seed of the run
+        :param level: int, level of the children
+        """
+        self.scale = scale
+        self.seed = seed
+        self.level = level
+
+    @cached_property
+    def tail(self) -> DiscreteGaussianTail:
+        return DiscreteGaussianTail(self.scale)
+
+    def get_generator(self, nodes: tuple[int, int]) -> np.random.Generator:
+        """
+        Return the generator of a parent pair
+        :param nodes: tuple[int, int], origin and destination codes of the parent pair
+        """
+        key = np.random.SeedSequence([self.seed, self.level, int(nodes[0]), int(nodes[1])]).generate_state(2, np.uint64)
+        return np.random.Generator(np.random.Philox(key=key))
+
+    def __call__(self, values: np.ndarray, nodes: tuple[int, int]) -> np.ndarray:
+        """
+        Return the noisy values of the children of a parent pair
+        :param values: np.ndarray, true values of the children
+        :param nodes: tuple[int, int], origin and destination codes of the parent pair
+        """
+        return np.asarray(values, dtype=np.int64) + sample_discrete_gaussian(self.scale, len(values),
+                                                                              self.get_generator(nodes))
+
+    def segments(self, values: np.ndarray, offsets: np.ndarray, parent_orig: np.ndarray,
+                 parent_dest: np.ndarray) -> np.ndarray:
+        """
+        Return the noisy values of the children of a batch of parent pairs, the children of the k-th pair are in
+        positions [offsets[k], offsets[k + 1]) of values
+        """
+        noise = np.zeros(len(values), dtype=np.int64)
+        for k, nodes in enumerate(zip(parent_orig.tolist(), parent_dest.tolist())):
+            noise[offsets[k]:offsets[k + 1]] = sample_discrete_gaussian(self.scale, int(offsets[k + 1] - offsets[k]),
+                                                                        self.get_generator(nodes))
+        return np.asarray(values, dtype=np.int64) + noise
+
+
+def make_keyed_gaussian_noise(d_in: Union[int, float], budget: float, seed: int, level: int) -> KeyedGaussianNoise:
+    """
+    Return a keyed discrete Gaussian noise with rho (from zCDP), with the same scale of `make_gaussian_noise`
+    :param d_in: l2 sensitivity
+    :param budget: privacy budget (rho in zCDP)
+    :param seed: seed of the run
+    :param level: level of the children
+    :return: KeyedGaussianNoise
+    """
+    assert budget > 0, f"Invalid budget: {budget}, must be > 0"
+    return KeyedGaussianNoise(scale=d_in / np.sqrt(2 * budget), seed=seed, level=level)
@@ -13,9 +13,13 @@ from datetime import datetime
 # Add the 'Main' directory to sys.path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-from metrics import analysis
-from mechanism import TDA, VanillaSH
-from data_structure import GeoSpine, OD_tree
+from metrics import analysis, concatenate_errors
+from mechanism import TDA, VanillaSH, MultiTDA, ShardedTDA
+from mechanism.instrumentation import Instrumentation, MemorySink, JSONLinesSink
+from mechanism.utils import derive_seed
+from data_structure import OD_tree, SQLite_OD_tree, AggregateCache
+from data_structure.cache import get_fingerprint
+from data_structure.utils import load_spine, load_dataset, get_dataset_files, decode_dataset
 
 
 def clear():
@@ -28,14 +32,26 @@ def clear():
 
 def main(args: argparse.Namespace):
     def apply_mechanism(mech: callable, args: argparse.Namespace,
-                        num_mech: int, num_eps: int, return_data: bool = False) -> Union[None, pd.DataFrame]:
+                        num_mech: int, num_eps: int, return_data: bool = False,
+                        releases: list = None) -> Union[None, pd.DataFrame]:
         absolute_error_distribution_epsilon = []
         for i in range(num_experiments):
             print(f"Experiment {i + 1}, epsilon: {args.epsilon}, mechanism: {num_mech}")
-            start = time.time()
-            data = mech(Tree, args)
-            end = time.time()
-            TIME[num_mech, num_eps, i] = end - start
+            if releases is None:
+                # each run has its own noise, derived from --seed
+                args.seed = None if base_seed is None else derive_seed(base_seed, num_mech, num_eps, i)
+                # one checkpoint for each TDA run, so that the runs do not overwrite each other
+                args.checkpoint = None if args.checkpoint_dir is None or mech is not TDA else \
+                    os.path.join(args.checkpoint_dir, f"mechanism_{num_mech}_epsilon_{args.epsilon}_experiment_{i}.npz")
+                start = time.time()
+                # with --shards the TDA runs release the subtrees of the first level in parallel processes
+                data = (ShardedTDA if mech is TDA and args.shards > 1 else mech)(Tree, args)
+                end = time.time()
+                TIME[num_mech, num_eps, i] = end - start
+            else:
+                # released by release_all_epsilons, the time of the pass is in SINGLE_PASS_TIME
+                data = releases[i]
+                TIME[num_mech, num_eps, i] = np.nan
             absolute_error_distribution = []
             for j, level in enumerate(tqdm.tqdm(levels, colour="green")):
                 workload = [[f"LEVEL{level[0]}_ORIG", f"LEVEL{level[1]}_DEST"]]
@@ -46,7 +62,7 @@ def main(args: argparse.Namespace):
                 max_error[num_mech, e, i, j] = analysis_dict["max_absolute_error"]
                 false_discovery_rate[num_mech, e, i, j] = analysis_dict["false_discovery_rate"]
                 false_negative_rate[num_mech, e, i, j] = analysis_dict["false_negative_rate"]
-                absolute_error_distribution.append(np.abs(analysis_dict["error_distribution"][0]))
+                absolute_error_distribution.append(analysis_dict["error_distribution"][0].abs())
             absolute_error_distribution_epsilon.append(absolute_error_distribution)
             # clear jupyter output on the terminal
             clear()
@@ -59,10 +75,11 @@ def main(args: argparse.Namespace):
             for i in range(num_experiments):
                 concantenation.append(absolute_error_distribution_epsilon[i][j])
             # assert they are all the same length
-            assert len(set([len(x) for x in concantenation])) == 1
-            # flatten the list
-            error_to_add[j] = np.mean(np.concatenate(concantenation))
-            std_to_add[j] = np.std(np.concatenate(concantenation))
+            assert len(set([x.size for x in concantenation])) == 1
+            # flatten the list, the zero errors stay implicit
+            errors = concatenate_errors(concantenation)
+            error_to_add[j] = errors.mean()
+            std_to_add[j] = errors.std()
         MAE[num_mech, num_eps] = error_to_add
         std[num_mech, num_eps] = std_to_add
 
@@ -71,25 +88,77 @@ def main(args: argparse.Namespace):
         else:
             return None
 
+    def release_all_epsilons(args: argparse.Namespace) -> list:
+        # one MultiTDA pass for each experiment: releases[e][i] is the release of the i-th experiment with the e-th
+        # epsilon, the time of the pass of all the epsilons is stored in SINGLE_PASS_TIME
+        releases = [[] for _ in epsilons]
+        args.checkpoint = None
+        for i in range(num_experiments):
+            print(f"Experiment {i + 1}, epsilons: {epsilons}, single pass")
+            # each pass has its own noise, MultiTDA derives the seed of each epsilon from it
+            args.seed = None if base_seed is None else derive_seed(base_seed, num_mech, i)
+            start = time.time()
+            datasets = MultiTDA(Tree, args)
+            end = time.time()
+            SINGLE_PASS_TIME[num_mech, i] = end - start
+            for e, data in enumerate(datasets):
+                releases[e].append(data)
+        return releases
+
     # load the data
     folder_path = args.file_path
-    with open(os.path.join(folder_path, "structure/geo_spine.pickle"), "rb") as f:
-        geo_spine = pickle.load(f)
-    df = pd.read_csv(os.path.join(folder_path, "data.csv"))
-    spine = GeoSpine(geo_spine)
-    Tree = OD_tree(df, spine)
+    spine = load_spine(os.path.join(folder_path, "structure"))
+    # true aggregates stored in <file-path>/cache by the first run, until the dataset or the spine change
+    dataset_files = [os.path.join(folder_path, "data.csv")] if args.backend == "sqlite" else \
+        get_dataset_files(folder_path)
+    fingerprint = get_fingerprint(dataset_files, spine, spine.depth)
+    cache = None if args.no_cache else AggregateCache(os.path.join(folder_path, "cache"), fingerprint)
+    if args.backend == "sqlite":
+        # the dataset stays on disk, the database is created from the CSV at the first run and created again when the
+        # CSV or the spine change (only complete databases are written to data.sqlite)
+        database_path = os.path.join(folder_path, "data.sqlite")
+        if SQLite_OD_tree.get_source_fingerprint(database_path) == fingerprint:
+            Tree = SQLite_OD_tree(database_path, spine, mode=args.mode, cache=cache)
+        else:
+            Tree = SQLite_OD_tree.from_csv(os.path.join(folder_path, "data.csv"), database_path, spine, mode=args.mode,
+                                           cache=cache, fingerprint=fingerprint)
+    else:
+        # memory-mapped columnar dataset if available, data.csv otherwise
+        df = load_dataset(folder_path)
+        Tree = OD_tree(df, spine, mode=args.mode, cache=cache)
+        del df  # the tree keeps a compact copy of the data
+    print(Tree.memory_report())
+
+    # per-level measurements of each run, streamed to <save-path>/instrumentation.jsonl or stored in the results pickle
+    if args.instrument == "jsonl":
+        os.makedirs(args.save_path, exist_ok=True)
+        instrumentation_sink = JSONLinesSink(os.path.join(args.save_path, "instrumentation.jsonl"))
+    else:
+        instrumentation_sink = MemorySink()
+    def instrumentation_sink_of_run(record: dict):
+        # a single pass of MultiTDA releases all the epsilons
+        epsilon = tuple(args.epsilons) if record["mechanism"] == "MultiTDA" else args.epsilon
+        instrumentation_sink(dict(record, epsilon=epsilon))
+
+    args.instrumentation = None if args.instrument == "off" else Instrumentation(instrumentation_sink_of_run)
 
     # get the data at the final level
     if args.final_level is None:
         args.final_level = Tree.depth
+    elif args.final_level > Tree.depth:
+        # the levels of the tree depend on the split schedule, e.g. 'joint' has half the levels of 'destination'
+        raise ValueError(f"--final-level {args.final_level} is not a level of the tree: with --mode {args.mode} the "
+                         f"final level is at most {Tree.depth}")
     final_level = args.final_level
     data_true = Tree.get_data_at_level(final_level)
 
     # get parameters
     epsilons = args.epsilons
+    # seed of the noise of the whole experiment, each run derives its own
+    base_seed = args.seed
     num_experiments = args.num_experiments
     # used to queries
-    geo_level = int(final_level / 2)
+    geo_level = Tree.get_geo_level(final_level)
     levels: list[tuple] = [(i, i) if i == j else (i, j) for i in range(geo_level + 1) for j in range(i, i + 2) if
                            j < geo_level + 1]
     # shape: mechanisms, epsilons, experiments, levels
@@ -102,6 +171,8 @@ def main(args: argparse.Namespace):
     std = np.zeros((num_mechanisms, len(epsilons), len(levels)))
     # shape: mechanism, epsilons, experiments
     TIME = np.zeros((num_mechanisms, len(epsilons), num_experiments))
+    # shape: mechanism, experiments, time of the single pass of all the epsilons (--single-pass), NaN in TIME
+    SINGLE_PASS_TIME = np.full((num_mechanisms, num_experiments), np.nan)
     num_mech = 0
 
     # RUN Stability Histogram
@@ -111,40 +182,46 @@ def main(args: argparse.Namespace):
     num_mech += 1
     # save the data if needed
     if args.return_data:
-        dp_data.to_csv(os.path.join(args.save_path, f"SH_data.csv"), index=False)
+        decode_dataset(dp_data, spine).to_csv(os.path.join(args.save_path, f"SH_data.csv"), index=False)
 
     # RUN GAUSSOPT with L2 norm
     args.p = 2
-    args.optimizer = "standard_int"
+    args.optimizer = args.l2_optimizer
+    args.engine = args.l2_engine
+    releases = release_all_epsilons(args) if args.single_pass else [None] * len(epsilons)
     for e, epsilon in enumerate(epsilons):
         args.epsilon = epsilon
-        dp_data = apply_mechanism(TDA, args, num_mech, e, args.return_data)
+        dp_data = apply_mechanism(TDA, args, num_mech, e, args.return_data, releases[e])
     num_mech += 1
     # save the data if needed
     if args.return_data:
-        dp_data.to_csv(os.path.join(args.save_path, f"TDA_l2_data.csv"), index=False)
+        decode_dataset(dp_data, spine).to_csv(os.path.join(args.save_path, f"TDA_l2_data.csv"), index=False)
 
     # RUN GAUSSOPT with Linf norm (no IntOpt)
     args.p = "inf"
     args.optimizer = "standard_int"
+    args.engine = "node"
+    releases = release_all_epsilons(args) if args.single_pass else [None] * len(epsilons)
     for e, epsilon in enumerate(epsilons):
         args.epsilon = epsilon
-        dp_data = apply_mechanism(TDA, args, num_mech, e, args.return_data)
+        dp_data = apply_mechanism(TDA, args, num_mech, e, args.return_data, releases[e])
     num_mech += 1
     # save the data if needed
     if args.return_data:
-        dp_data.to_csv(os.path.join(args.save_path, f"TDA_linf_data.csv"), index=False)
+        decode_dataset(dp_data, spine).to_csv(os.path.join(args.save_path, f"TDA_linf_data.csv"), index=False)
 
     # RUN GAUSSOPT with Linf norm (IntOpt)
     args.p = "inf"
     args.optimizer = "fast_int_opt"
+    args.engine = args.fast_int_opt_engine
+    releases = release_all_epsilons(args) if args.single_pass else [None] * len(epsilons)
     for e, epsilon in enumerate(epsilons):
         args.epsilon = epsilon
-        dp_data = apply_mechanism(TDA, args, num_mech, e, args.return_data)
+        dp_data = apply_mechanism(TDA, args, num_mech, e, args.return_data, releases[e])
     num_mech += 1
     # save the data if needed
     if args.return_data:
-        dp_data.to_csv(os.path.join(args.save_path, f"TDA_linf_IntOpt_data.csv"), index=False)
+        decode_dataset(dp_data, spine).to_csv(os.path.join(args.save_path, f"TDA_linf_IntOpt_data.csv"), index=False)
 
     # create the folder to save the data
     if not os.path.exists(args.save_path):
@@ -164,6 +241,7 @@ def main(args: argparse.Namespace):
     with open(os.path.join(folder_path, filename), "wb") as f:
         # save as a dictionary
         pickle.dump({"TIME": TIME,
+                     "SINGLE_PASS_TIME": SINGLE_PASS_TIME,
                      "MAE": MAE,
                      "std": std,
                      "max_error": max_error,
@@ -171,6 +249,7 @@ def main(args: argparse.Namespace):
                      "false_negative_rate": false_negative_rate,
                      "epsilons": epsilons,
                      "num_experiments": num_experiments,
+                     "instrumentation": instrumentation_sink.records if args.instrument == "pickle" else None,
                      "date": today}, f)
 
 
@@ -190,11 +269,83 @@ if __name__ == "__main__":
     parser.add_argument("--num-experiments", type=int, help="Number of experiments", default=10)
     parser.add_argument("--show-tqdm", action="store_true", help="Show tqdm progress bar", default=True)
     parser.add_argument("--split-method", type=str, help="Split method", default="uniform")
-    parser.add_argument("--final-level", type=int, help="Final level", default=None)
+    parser.add_argument("--final-level", type=int, default=None,
+                        help="Final level of the tree, at most the depth of the tree of --mode (twice the levels of "
+                             "the spine with destination or origin, the levels of the spine with joint)")
+    parser.add_argument("--mode", type=str, choices=["destination", "origin", "joint"], default="destination",
+                        help="Split schedule of the tree, 'joint' splits origin and destination in the same level "
+                             "(the final level is then the level of the spine)")
+    parser.add_argument("--checkpoint-dir", type=str, default=None,
+                        help="Folder of the checkpoints of the TDA runs, one for each mechanism, epsilon and "
+                             "experiment, saved after each released level and removed when the run is complete")
+    parser.add_argument("--resume", action="store_true",
+                        help="Resume the TDA runs from the checkpoints in --checkpoint-dir")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes sharing the parents of each level of TDA")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="Number of processes releasing the subtrees of the first level of TDA (ShardedTDA), "
+                             "with the keyed noise of --seed")
+    parser.add_argument("--pipeline", type=int, default=0,
+                        help="Number of chunks of parents whose children TDA queries ahead, while consumer threads "
+                             "noise and optimize the previous ones (0 disables the pipeline)")
+    parser.add_argument("--consumers", type=int, default=1,
+                        help="Number of consumer threads of the pipeline")
+    parser.add_argument("--engine", type=str, choices=["node", "vectorized"], default="node",
+                        dest="fast_int_opt_engine",
+                        help="Engine of the TDA runs with fast_int_opt, 'vectorized' processes each level as "
+                             "flat arrays")
+    parser.add_argument("--l2-optimizer", type=str, choices=["standard_int", "l2_simplex"], default="standard_int",
+                        help="Optimizer of the TDA runs with the L2 norm, 'l2_simplex' projects by sorting instead of "
+                             "solving a CVXPY problem for each parent")
+    parser.add_argument("--l2-engine", type=str, choices=["node", "sparse"], default="node",
+                        help="Engine of the TDA runs with the L2 norm, 'sparse' draws explicitly only the noise of the "
+                             "zero cells that can be non-zero after the projection (needs --l2-optimizer l2_simplex "
+                             "and --noise keyed or native)")
+    parser.add_argument("--traversal", type=str, choices=["breadth", "depth"], default="breadth",
+                        help="Traversal of the tree in TDA, 'depth' releases a subtree at a time with bounded memory")
+    parser.add_argument("--noise", type=str, choices=["opendp", "keyed", "native"], default="opendp",
+                        help="Noise of TDA, 'keyed' draws the noise of each parent pair from --seed, so that the "
+                             "release does not depend on how the parents are split, 'native' draws the noise in "
+                             "blocks without the per-call overhead of OpenDP")
+    parser.add_argument("--noise-check", action="store_true",
+                        help="Check the calibration of the native noise against OpenDP at each level")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Seed of the keyed or native noise, each run (mechanism, epsilon, experiment) derives its "
+                             "own seed from it")
+    parser.add_argument("--single-pass", action="store_true",
+                        help="Release all the epsilons of each TDA experiment in a single traversal (MultiTDA)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Do not store the true aggregates of the dataset in <file-path>/cache")
+    parser.add_argument("--instrument", type=str, choices=["off", "pickle", "jsonl"], default="off",
+                        help="Record the size of the child vectors, the time of each phase and the peak memory of each "
+                             "level, in the results pickle or in <save-path>/instrumentation.jsonl")
+    parser.add_argument("--backend", type=str, choices=["memory", "sqlite"], default="memory",
+                        help="Storage of the dataset, 'sqlite' keeps it in <file-path>/data.sqlite")
     parser.add_argument("--file-path", type=str, help="File path", required=True)
     parser.add_argument("--save-path", type=str, help="Save path", required=True)
     parser.add_argument("--return-data", action="store_true", help="Return the data", default=False)
 
     args = parser.parse_args()
+    if args.resume and args.checkpoint_dir is None:
+        parser.error("--resume needs --checkpoint-dir")
+    if args.checkpoint_dir is not None and args.traversal == "depth":
+        parser.error("the checkpoints are supported only by the breadth-first traversal")
+    if args.l2_engine == "sparse" and args.l2_optimizer != "l2_simplex":
+        parser.error("--l2-engine sparse needs --l2-optimizer l2_simplex")
+    if args.l2_engine == "sparse" and args.noise == "opendp":
+        parser.error("--l2-engine sparse needs --noise keyed or native")
+    if args.l2_engine == "sparse" and args.pipeline > 0:
+        parser.error("--l2-engine sparse is not supported by the pipeline")
+    if args.single_pass and (args.workers > 1 or args.pipeline > 0 or args.traversal == "depth"):
+        parser.error("--single-pass runs a breadth-first traversal in a single process, without --workers, "
+                     "--pipeline or --traversal depth")
+    if args.shards > 1 and args.seed is None:
+        parser.error("--shards needs --seed")
+    if args.shards > 1 and (args.single_pass or args.workers > 1 or args.pipeline > 0 or args.traversal == "depth" or
+                            args.checkpoint_dir is not None or args.backend == "sqlite" or args.instrument != "off"):
+        parser.error("--shards runs each shard in a single process with the data in memory, without --single-pass, "
+                     "--workers, --pipeline, --traversal depth, --checkpoint-dir, --backend sqlite or --instrument")
+    if args.checkpoint_dir is not None:
+        os.makedirs(args.checkpoint_dir, exist_ok=True)
     clear()
     main(args)
@@ -0,0 +1,171 @@
+import pandas as pd
+import numpy as np
+import argparse
+import time
+import tqdm
+from functools import partial
+from .utils import split_rho_budget, derive_seed
+from .instrumentation import Instrumentation
+from .TDA import _get_options, _make_noise, _optimize_chunk, _optimize_chunk_sparse, _optimize_chunk_vectorized, \
+    _empty_frontier
+from data_structure.tree import OD_tree, ChildQuery
+from data_structure.utils import get_dataset_from_arrays
+from differential_privacy import get_rho_from_budget
+
+
+def MultiTDA(Tree: OD_tree, args: argparse.Namespace) -> list[pd.DataFrame]:
+    """
+    TDA for several privacy budgets in a single traversal of the tree: one independent release for each epsilon of
+    args.epsilons (with the same delta). Each release has its own budget split and constraints, at each level the
+    children of the parents of all the releases are queried once and shared, only the noise and the optimization are
+    done for each release. Each release has the distribution of TDA with its epsilon.
+    :param args: argparse.Namespace containing input arguments, as TDA, with epsilons instead of epsilon. The engine
+                 can be "node", "vectorized" or "sparse", the traversal is breadth-first in a single process (no
+                 workers, pipeline or checkpoint).
+    :param Tree: OD_tree object containing a tree structure.
+    :return: list[pd.DataFrame] containing the differentially private dataset of each epsilon.
+    """
+
+    start: float = time.time()
+
+    # measurements of each level, of all the releases together, sent to its sink at the end of the run
+    stats: Instrumentation = vars(args).get('instrumentation', None)
+    if stats is not None:
+        stats.start("MultiTDA")
+
+    # define privacy budgets
+    epsilons: list[float] = [float(epsilon) for epsilon in args.epsilons]
+    delta: float = float(args.delta)
+
+    # define the final level of the tree to reach
+    final_level: int = vars(args).get('final_level', Tree.depth)
+    Tree.check_level(final_level)
+
+    # split the budget of each release among the levels
+    b = vars(args).get('b', None)
+    budget_lists: list[list[float]] = [split_rho_budget(rho=get_rho_from_budget((epsilon, delta)),
+                                                        T=Tree.get_budget_rounds(final_level),
+                                                        method=args.split_method,
+                                                        b=b) for epsilon in epsilons]
+
+    # l2 sensitivity
+    max_contribution = vars(args).get('max_contribution', 1)
+    sensitivity: float = np.sqrt(2 * max_contribution)
+
+    # optimizer, engine and noise of the releases, checked as in TDA
+    optimizer, engine, noise, seed = _get_options(args)
+
+    # the releases share a breadth-first traversal in a single process, without checkpoints
+    if (vars(args).get('workers', 1) or 1) > 1:
+        raise ValueError("MultiTDA runs in a single process, got workers > 1")
+    elif (vars(args).get('pipeline', 0) or 0) > 0:
+        raise ValueError("MultiTDA does not support the pipeline")
+    elif vars(args).get('traversal', 'breadth') != "breadth":
+        raise ValueError("MultiTDA supports only the breadth-first traversal")
+    elif vars(args).get('checkpoint', None) is not None:
+        raise ValueError("MultiTDA does not support checkpoints")
+
+    # number of parents queried together
+    batch_size: int = vars(args).get('batch_size', 1024)
+
+    # noise of each release, the keyed and the native noise get a different seed for each release
+    make_noises: list = [partial(_make_noise, sensitivity=sensitivity, noise=noise,
+                                 seed=None if seed is None else _get_release_seed(seed, release),
+                                 check=vars(args).get('noise_check', False)) for release in range(len(epsilons))]
+
+    # get total number of users, once for all the releases
+    n: float = Tree.sparse_query_level(level=0).values.sum()
+    """ HERE to add for privacy by addition/removal, n needs to be DP"""
+    # constraints of each release, as (origin codes, destination codes, constraints)
+    frontiers: list = [(np.zeros(1, dtype=np.int32), np.zeros(1, dtype=np.int32), np.array([int(n)], dtype=np.int64))
+                       for _ in epsilons]
+    for level in range(1, final_level + 1):
+        print(f"Optimizing level {level}/{final_level} of {len(epsilons)} releases ({Tree.mode} split)...")
+        level_start: float = time.perf_counter()
+        dp_mechanisms: list = [make_noise(budget=budget_list[level - 1], level=level)
+                               for make_noise, budget_list in zip(make_noises, budget_lists)]
+
+        # parents of all the releases, each parent is queried once
+        number_of_dest: int = Tree.spine.level_size(Tree._get_od_levels(level - 1)[1])
+        keys: list = [frontier[0].astype(np.int64) * number_of_dest + frontier[1] for frontier in frontiers]
+        parent_keys, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+        inverse = np.split(inverse, np.cumsum([len(k) for k in keys])[:-1])
+        # sort the parents of each release by position in parent_keys, so each chunk is a slice of each release
+        orders: list = [np.argsort(i, kind="stable") for i in inverse]
+        frontiers = [tuple(x[order] for x in frontier) for frontier, order in zip(frontiers, orders)]
+        inverse = [i[order] for i, order in zip(inverse, orders)]
+
+        children: list = [[_empty_frontier()] for _ in epsilons]
+        progress_bar = tqdm.tqdm(total=len(parent_keys), colour='green') if args.show_tqdm else None
+        for chunk_start in range(0, len(parent_keys), batch_size):
+            chunk_keys: np.ndarray = parent_keys[chunk_start:chunk_start + batch_size]
+            if stats is not None:
+                stats.reset_lap()
+            chunk_nodes: tuple = (chunk_keys // number_of_dest, chunk_keys % number_of_dest)
+            # the sparse engine queries only the non-zero children of each parent, in the optimization of the release
+            q: ChildQuery = None if engine == "sparse" else \
+                Tree.full_child_query_level_batch(level=level - 1, nodes=chunk_nodes)
+            if stats is not None:
+                # the parents are shared by the releases, their children are recorded once
+                if q is not None:
+                    stats.lap(level, "query")
+                stats.add_children(level, np.diff(q.offsets) if q is not None else
+                                   _get_children_sizes(Tree, level - 1, chunk_nodes))
+            # time and optimizer calls of the releases, added to stats without the shared children
+            release_stats: Instrumentation = Instrumentation() if stats is not None else None
+            for release, frontier in enumerate(frontiers):
+                first, last = np.searchsorted(inverse[release], [chunk_start, chunk_start + len(chunk_keys)])
+                if first == last:
+                    continue
+                chunk: tuple = tuple(x[first:last] for x in frontier)
+                q_release: ChildQuery = None if q is None else q.select(inverse[release][first:last] - chunk_start)
+                if engine == "sparse":
+                    children[release].append(_optimize_chunk_sparse(Tree, level, dp_mechanisms[release], optimizer,
+                                                                    chunk, stats=release_stats))
+                elif engine == "vectorized":
+                    children[release].append(_optimize_chunk_vectorized(Tree, level, dp_mechanisms[release], chunk,
+                                                                        q=q_release, stats=release_stats))
+                else:
+                    children[release].append(_optimize_chunk(Tree, level, dp_mechanisms[release], optimizer, chunk,
+                                                             q=q_release, stats=release_stats))
+            if stats is not None:
+                stats.merge(release_stats.levels, children=False)
+            if progress_bar is not None:
+                progress_bar.update(len(chunk_keys))
+        if progress_bar is not None:
+            progress_bar.close()
+        frontiers = [tuple(np.concatenate(x) for x in zip(*release_children)) for release_children in children]
+        if stats is not None:
+            stats.end_level(level, time.perf_counter() - level_start)
+
+    geo_level = Tree.get_geo_level(final_level)
+    dp_datasets: list[pd.DataFrame] = [get_dataset_from_arrays(orig=frontier[0],
+                                                               dest=frontier[1],
+                                                               values=frontier[2],
+                                                               spine=Tree.spine,
+                                                               geo_level=geo_level) for frontier in frontiers]
+    if stats is not None:
+        stats.flush()
+
+    end: float = time.time()
+    print(f"Time took to create the {len(epsilons)} datasets: {end - start:.2f} seconds")
+    print("Done!")
+    return dp_datasets
+
+
+def _get_release_seed(seed: int, release: int) -> int:
+    """
+    Return the seed of a release, derived from the seed of the run so that the releases are independent
+    """
+    return derive_seed(seed, release)
+
+
+def _get_children_sizes(Tree: OD_tree, level: int, nodes: tuple) -> list[int]:
+    """
+    Return the size of the child vector of each parent pair of a level
+    """
+    sizes: list = []
+    for node in zip(nodes[0].tolist(), nodes[1].tolist()):
+        orig_start, orig_end, dest_start, dest_end = Tree._get_children_range(level, node)
+        sizes.append((orig_end - orig_start) * (dest_end - dest_start))
+    return sizes
@@ -0,0 +1,125 @@
+import pandas as pd
+import numpy as np
+import argparse
+import time
+import multiprocessing
+from data_structure.tree import OD_tree
+from data_structure.geospine import GeoSpine
+from .TDA import TDA
+
+
+def ShardedTDA(Tree: OD_tree, args: argparse.Namespace) -> pd.DataFrame:
+    """
+    TDA with the subtrees of the first level released independently. The coordinator releases the first level, then
+    the parent pairs of the first level are split in args.shards shards, each released by `release_shard` in its own
+    process with only its slice of the data, and the leaves of the shards are concatenated. The noise is keyed by
+    (args.seed, level, parent pair), so the release is the one of TDA with the keyed noise and does not depend on the
+    number of shards. The same functions can run the shards on different machines:
+        - coordinator: level, frontier = release_first_level(Tree, args)
+                       shards = shard_frontier(frontier, number_of_shards)
+                       ship get_shard_data(Tree, shard), the spine, args and (level, shard) to each machine
+        - machine: release_shard(shard_data, spine, args, (level, shard))
+        - coordinator: pd.concat of the released shards
+    :param args: argparse.Namespace containing input arguments, as TDA, with seed and shards. The data of the tree must
+                 be in memory (not SQLite_OD_tree). The runners use it for the TDA runs with --shards.
+    :param Tree: OD_tree object containing a tree structure.
+    :return: pd.DataFrame containing the differentially private dataset.
+    """
+    start: float = time.time()
+    # the shards build their trees with the same split schedule
+    args = argparse.Namespace(**dict(vars(args), mode=Tree.mode))
+    number_of_shards: int = vars(args).get('shards', 1) or 1
+    final_level: int = vars(args).get('final_level', None)
+    if (Tree.depth if final_level is None else final_level) <= 1:
+        # no subtree below the first level, the release is the one of TDA
+        return TDA(Tree, _get_keyed_args(args))
+    level, frontier = release_first_level(Tree, args)
+    shards: list = shard_frontier(frontier, number_of_shards)
+    tasks: list = [(get_shard_data(Tree, shard), Tree.spine, args, (level, shard)) for shard in shards]
+    print(f"Releasing {len(shards)} shards of {len(frontier[2])} subtrees...")
+    if number_of_shards > 1:
+        with multiprocessing.Pool(processes=number_of_shards) as pool:
+            released: list = pool.starmap(release_shard, tasks)
+    else:
+        released: list = [release_shard(*task) for task in tasks]
+    dp_dataset: pd.DataFrame = pd.concat(released, ignore_index=True)
+    end: float = time.time()
+    print(f"Time took to create the dataset: {end - start:.2f} seconds")
+    return dp_dataset
+
+
+def _get_keyed_args(args: argparse.Namespace, **kwargs) -> argparse.Namespace:
+    """
+    Return a copy of the arguments with the keyed noise, the breadth-first traversal, in a single process
+    """
+    if vars(args).get('seed', None) is None:
+        raise ValueError("ShardedTDA needs a seed")
+    keyed_args = dict(vars(args), noise="keyed", traversal="breadth", workers=1, checkpoint=None)
+    keyed_args.update(kwargs)
+    return argparse.Namespace(**keyed_args)
+
+
+def release_first_level(Tree: OD_tree, args: argparse.Namespace) -> tuple[int, tuple]:
+    """
+    Release the first level of the tree, with the budget split of the whole run
+    :param Tree: OD_tree object containing a tree structure.
+    :param args: argparse.Namespace containing input arguments, as TDA, with seed.
+    :return: (1, constraints), constraints are (origin codes, destination codes, constraints) of the first level
+    """
+    return TDA(Tree, _get_keyed_args(args, stop_level=1))
+
+
+def shard_frontier(frontier: tuple, number_of_shards: int) -> list[tuple]:
+    """
+    Split the constraints of a level in shards of parent pairs with similar total flow, each parent pair is the root
+    of an independent subtree
+    :param frontier: tuple, (origin codes, destination codes, constraints)
+    :param number_of_shards: int, number of shards
+    :return: list[tuple], constraints of each non-empty shard
+    """
+    # assign the largest subtrees first, each to the lightest shard
+    order = np.argsort(-frontier[2], kind="stable")
+    loads = np.zeros(number_of_shards, dtype=np.int64)
+    assignment = np.zeros(len(order), dtype=np.int64)
+    for i in order:
+        shard = int(np.argmin(loads))
+        assignment[i] = shard
+        loads[shard] += frontier[2][i]
+    return [tuple(x[assignment == shard] for x in frontier) for shard in range(number_of_shards)
+            if np.any(assignment == shard)]
+
+
+def get_shard_data(Tree: OD_tree, frontier: tuple) -> pd.DataFrame:
+    """
+    Return the rows of the data of the tree in the subtrees of a shard, with the codes of the nodes
+    :param Tree: OD_tree object containing a tree structure.
+    :param frontier: tuple, (origin codes, destination codes, constraints) of the roots of the subtrees, at level 1
+    :return: pd.DataFrame, slice of Tree.data
+    """
+    if Tree.data is None:
+        raise ValueError("The shards need the data of the tree in memory, the SQLite backend is not supported")
+    od_level: tuple = Tree._get_od_levels(1)
+    orig_column = "LEVEL" + str(od_level[0]) + Tree.orig_dest[0]
+    dest_column = "LEVEL" + str(od_level[1]) + Tree.orig_dest[1]
+    shape = (Tree.spine.level_size(od_level[0]), Tree.spine.level_size(od_level[1]))
+    keys = Tree.data[orig_column].to_numpy().astype(np.int64) * shape[1] + Tree.data[dest_column].to_numpy()
+    roots = frontier[0].astype(np.int64) * shape[1] + frontier[1]
+    shard_data = Tree.data[np.isin(keys, roots)]
+    shard_data.attrs["encoded"] = True
+    return shard_data
+
+
+def release_shard(shard_data: pd.DataFrame, spine: GeoSpine, args: argparse.Namespace, start_from: tuple):
+    """
+    Release the subtrees of a shard, from the level after start_from to the final level
+    :param shard_data: pd.DataFrame, data of the shard returned by `get_shard_data`
+    :param spine: GeoSpine, spine of the dataset
+    :param args: argparse.Namespace containing input arguments of the run, with seed
+    :param start_from: tuple, (level, constraints) of the roots of the subtrees
+    :return: pd.DataFrame containing the differentially private dataset of the shard
+    """
+    Tree = OD_tree(shard_data, spine, mode=vars(args).get('mode', 'destination'))
+    shard_args = _get_keyed_args(args, start_from=start_from)
+    if vars(shard_args).get('final_level', None) is None:
+        shard_args.final_level = Tree.depth
+    return TDA(Tree, shard_args)
@@ -1,16 +1,21 @@
-from collections.abc import ItemsView
-
 import pandas as pd
 import numpy as np
 import argparse
+import os
 import time
 import tqdm
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import opendp as dp
-from .utils import split_rho_budget
-from data_structure.tree import OD_tree
-from data_structure.utils import get_dataset_from_dict
-from optimization import fast_int_opt, standard_int_opt
-from differential_privacy import make_gaussian_noise, get_rho_from_budget
+from .utils import split_rho_budget, save_checkpoint, load_checkpoint
+from .instrumentation import Instrumentation
+from data_structure.tree import OD_tree, ChildQuery
+from data_structure.utils import get_dataset_from_arrays
+from optimization import fast_int_opt, standard_int_opt, l2_simplex_opt, segmented_fast_int_opt, simplex_threshold
+from differential_privacy import make_gaussian_noise, make_keyed_gaussian_noise, KeyedGaussianNoise, \
+    make_buffered_gaussian_noise, sample_discrete_gaussian, get_rho_from_budget
 
 
 def TDA(Tree: OD_tree, args: argparse.Namespace) -> pd.DataFrame:
@@ -19,11 +24,17 @@ def TDA(Tree: OD_tree, args: argparse.Namespace) -> pd.DataFrame:
     discrete domain, as the optimization step.
     :param args: argparse.Namespace containing input arguments.
     :param Tree: OD_tree object containing a tree structure.
-    :return: pd.DataFrame containing the differentially private dataset.
+    :return: pd.DataFrame containing the differentially private dataset, None if it is streamed to args.sink, or
+             (level, constraints) if args.stop_level is lower than the final level.
     """
 
     start: float = time.time()
 
+    # measurements of each level, sent to its sink at the end of the run
+    stats: Instrumentation = vars(args).get('instrumentation', None)
+    if stats is not None:
+        stats.start("TDA")
+
     # define privacy budget
     epsilon: float = float(args.epsilon)
     delta: float = float(args.delta)
@@ -32,11 +43,12 @@ def TDA(Tree: OD_tree, args: argparse.Namespace) -> pd.DataFrame:
 
     # define the final level of the tree to reach
     final_level: int = vars(args).get('final_level', Tree.depth)
+    Tree.check_level(final_level)
 
-    # split the budget uniformly among the levels
+    # split the budget among the levels, as many shares as the split schedule of the tree gives
     b = vars(args).get('b', None)  # feature to implement
     budget_list: list[float] = split_rho_budget(rho=rho,
-                                                T=final_level * 2,
+                                                T=Tree.get_budget_rounds(final_level),
                                                 method=args.split_method,
                                                 b=b)
 
@@ -44,58 +56,609 @@ def TDA(Tree: OD_tree, args: argparse.Namespace) -> pd.DataFrame:
     max_contribution = vars(args).get('max_contribution', 1)
     sensitivity: float = np.sqrt(2 * max_contribution)
 
-    # get optimizer
-    if args.optimizer == "fast_int_opt":
-        optimizer = fast_int_opt
-    elif args.optimizer == "standard_int":
-        optimizer = lambda x, y: standard_int_opt(x, y, p=args.p)
-    else:
-        raise ValueError(f"Invalid optimizer: {args.optimizer}")
+    # optimizer, engine and noise of the run, checked together
+    optimizer, engine, noise, seed = _get_options(args)
+
+    # number of parents queried together
+    batch_size: int = vars(args).get('batch_size', 1024)
+    noise_check: bool = vars(args).get('noise_check', False)
+    make_noise: callable = partial(_make_noise, sensitivity=sensitivity, noise=noise, seed=seed, check=noise_check)
+
+    # traversal of the tree: "breadth" releases a level at a time, "depth" releases a subtree at a time and streams
+    # each chunk of leaves to the sink (any callable receiving a pd.DataFrame, e.g. CSVSink) as soon as it is released
+    traversal: str = vars(args).get('traversal', 'breadth')
+    if traversal not in ["breadth", "depth"]:
+        raise ValueError(f"Invalid traversal: {traversal}")
+    sink: callable = vars(args).get('sink', None)
+
+    # checkpoint saved after each released level, with resume the run continues from the last released level
+    checkpoint_path: str = vars(args).get('checkpoint', None)
+    resume: bool = vars(args).get('resume', False)
+    if checkpoint_path is not None and traversal == "depth":
+        raise ValueError("Checkpoints are supported only by the breadth-first traversal")
+
+    # number of processes sharing the parents of each level, each with its own noise sampler (the vectorized engine
+    # and the depth-first traversal run in a single process)
+    workers: int = (vars(args).get('workers', 1) or 1) if engine != "vectorized" and traversal == "breadth" else 1
+    if workers > 1 and noise == "native" and seed is not None:
+        raise ValueError("The seeded native noise would repeat the same samples in each worker, use the keyed noise")
+    if workers > 1:
+        # build the child indexes once, before the tree is shared with the workers
+        for level in range(final_level):
+            Tree._get_child_index(level)
+
+    # pipelined execution: the batched child queries of the next chunks (at most pipeline chunks ahead) overlap the
+    # noise and the optimization of the previous ones, run by consumer threads. 0 disables it
+    pipeline: int = vars(args).get('pipeline', 0) or 0
+    consumers: int = vars(args).get('consumers', 1) or 1
+    if pipeline > 0 and (traversal != "breadth" or workers > 1 or engine == "sparse"):
+        raise ValueError("The pipeline supports only the breadth-first traversal in a single process with the node or "
+                         "the vectorized engine")
+    elif pipeline > 0 and consumers > 1 and noise == "native":
+        raise ValueError("The native noise cannot be shared by several consumers, use the keyed or the opendp noise")
 
     # get total number of users
-    n: float = Tree.full_query_level(level=0).values[0]
+    n: float = Tree.sparse_query_level(level=0).values.sum()
     """ HERE to add for privacy by addition/removal, n needs to be DP"""
-    c: dict = {(0, 0): int(n)}  # initial constraint
-    count: int = 0  # initialize the counter
-    for level in range(1, final_level + 1):
-        print(f"Optimizing level {level}/{final_level}...")
-
-        # dictionary to store the optimized constraint
-        V_ell: dict = {}
-
-        # instantiate the guassian mechanism
-        dp_mechanism: dp.Measurement = make_gaussian_noise(d_in=sensitivity,
-                                                           budget=budget_list[count],
-                                                           dtype=int)
-
-        # create the iterable
-        if args.show_tqdm:
-            constraint_items: ItemsView = tqdm.tqdm(c.items(), colour='green')
+    # initial constraint, the constraints are parallel arrays (origin codes, destination codes, constraints)
+    frontier: tuple = (np.zeros(1, dtype=np.int32), np.zeros(1, dtype=np.int32), np.array([int(n)], dtype=np.int64))
+    first_level: int = 1
+    # parameters of the run saved with the checkpoint, the released levels are never noised again so a run resumes
+    # only with the same parameters and dataset
+    run: dict = {"epsilon": epsilon, "delta": delta, "final_level": final_level, "mode": Tree.mode,
+                 "split_method": args.split_method, "optimizer": args.optimizer, "p": vars(args).get('p', None),
+                 "noise": noise, "seed": seed, "engine": engine,
+                 "fingerprint": Tree.get_fingerprint() if checkpoint_path is not None else None}
+    if checkpoint_path is not None and resume and os.path.exists(checkpoint_path):
+        checkpoint: dict = load_checkpoint(checkpoint_path)
+        saved_run: dict = {key: checkpoint["args"].get(key) for key in run}
+        if saved_run != run:
+            raise ValueError(f"The checkpoint belongs to a different run: {saved_run}, expected {run}")
+        budget_list = checkpoint["budget_list"]
+        frontier = checkpoint["frontier"]
+        first_level = checkpoint["level"] + 1
+        print(f"Resuming from level {checkpoint['level']}/{final_level}")
+    # (level, constraints) released elsewhere, e.g. by the coordinator of ShardedTDA, the run starts from the next level
+    start_from: tuple = vars(args).get('start_from', None)
+    if start_from is not None:
+        frontier = start_from[1]
+        first_level = start_from[0] + 1
+    # last level to release, by default the final level. If it is lower, its constraints are returned
+    stop_level: int = vars(args).get('stop_level', final_level)
+    if stop_level < final_level and traversal == "depth":
+        raise ValueError("The depth-first traversal releases the leaves")
+    geo_level = Tree.get_geo_level(final_level)
+    pool = multiprocessing.Pool(processes=workers,
+                                initializer=_init_worker,
+                                initargs=(Tree, make_noise, budget_list, optimizer, engine)) if workers > 1 else None
+    try:
+        if traversal == "depth":
+            print(f"Optimizing levels {first_level}-{final_level} depth-first ({Tree.mode} split)...")
+            dp_mechanisms: list = [make_noise(budget=budget_list[count], level=count + 1)
+                                   for count in range(final_level)]
+            released: list = []
+
+            def leaves_sink(leaves: tuple):
+                # the final constraint of each subtree contains (leaf node, leaf node) pairs and their flow
+                dataset = get_dataset_from_arrays(*leaves, spine=Tree.spine, geo_level=geo_level)
+                if sink is None:
+                    released.append(dataset)
+                else:
+                    sink(dataset)
+
+            if first_level <= final_level:
+                _optimize_subtrees(Tree, first_level, final_level, dp_mechanisms, optimizer, engine, frontier,
+                                   batch_size, leaves_sink, stats)
+            else:
+                leaves_sink(frontier)
         else:
-            constraint_items: ItemsView = c.items()
-
-        for nodes, constraint in constraint_items:
-            # Apply differential privacy mechanism
-            q_c: pd.Series = Tree.full_child_query_level(level=level-1, nodes=nodes)
-            dp_q_c_values: np.array = np.array(dp_mechanism(q_c.values)).astype(int)
-            # Apply optimization
-            bar_q_c_values: np.array = optimizer(dp_q_c_values, constraint)
-            # Post process the data, remove zero values
-            bar_q_c: dict = {key: int(value) for key, value in zip(q_c.index, bar_q_c_values) if value > 0}
-            # Update the constraints
-            V_ell.update(bar_q_c)
-
-        # update the constraint
-        c = V_ell
-        count += 1
-
-    # the final constraint is a dictionary containing (leaf node, leaf node) as key and the flow as value
-    geo_level = int(final_level/2)
-    dp_dataset: pd.DataFrame = get_dataset_from_dict(data_dict=c,
-                                                     spine=Tree.spine,
-                                                     geo_level=geo_level)
+            count: int = first_level - 1  # initialize the counter
+            for level in range(first_level, stop_level + 1):
+                print(f"Optimizing level {level}/{final_level} ({Tree.mode} split)...")
+                level_start: float = time.perf_counter()
+
+                # instantiate the guassian mechanism
+                dp_mechanism: dp.Measurement = make_noise(budget=budget_list[count], level=level)
+
+                if engine == "vectorized":
+                    # the whole level as flat arrays
+                    frontier = _optimize_level_vectorized(Tree, level, dp_mechanism, frontier, batch_size,
+                                                          args.show_tqdm, stats, pipeline, consumers)
+                else:
+                    # optimized constraints of each chunk
+                    V_ell: list = [_empty_frontier()]
+
+                    # create the progress bar
+                    progress_bar = tqdm.tqdm(total=len(frontier[2]), colour='green') if args.show_tqdm else None
+
+                    # query the children of the parents in chunks, one batched query per chunk
+                    chunks: list = [tuple(x[chunk_start:chunk_start + batch_size] for x in frontier)
+                                    for chunk_start in range(0, len(frontier[2]), batch_size)]
+                    if pool is None and pipeline > 0:
+                        optimize_chunk: callable = partial(_optimize_chunk, Tree, level, dp_mechanism, optimizer)
+                        results = _optimize_chunks_pipelined(Tree, level, optimize_chunk, chunks,
+                                                             (chunk[:2] for chunk in chunks), pipeline, consumers,
+                                                             stats)
+                    elif pool is None:
+                        optimize_chunk: callable = _optimize_chunk_sparse if engine == "sparse" else _optimize_chunk
+                        results = ((optimize_chunk(Tree, level, dp_mechanism, optimizer, chunk, stats=stats), None)
+                                   for chunk in chunks)
+                    else:
+                        # chunks are the work units of the pool, results are merged in the same order
+                        results = pool.imap(partial(_optimize_chunk_in_worker, level, stats is not None), chunks)
+                    for chunk, (bar_q_c, worker_levels) in zip(chunks, results):
+                        # Update the constraints
+                        V_ell.append(bar_q_c)
+                        if worker_levels is not None:
+                            stats.merge(worker_levels)
+                        if progress_bar is not None:
+                            progress_bar.update(len(chunk[2]))
+                    if progress_bar is not None:
+                        progress_bar.close()
+
+                    # update the constraint
+                    frontier = tuple(np.concatenate(x) for x in zip(*V_ell))
+                count += 1
+                if stats is not None:
+                    stats.end_level(level, time.perf_counter() - level_start)
 
+                if checkpoint_path is not None:
+                    save_checkpoint(checkpoint_path, level, frontier, budget_list, dict(vars(args), **run))
+    except BaseException:
+        # the workers are stopped also on errors and interruptions
+        if pool is not None:
+            pool.terminate()
+        raise
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    if stop_level < final_level:
+        if stats is not None:
+            stats.flush()
+        # the constraints of the last released level, as (origin codes, destination codes, constraints)
+        return stop_level, frontier
+
+    # the final constraint contains (leaf node, leaf node) pairs and their flow
+    if traversal == "depth":
+        # the leaves have been streamed to the sink
+        dp_dataset: pd.DataFrame = pd.concat(released, ignore_index=True) if sink is None else None
+    else:
+        dp_dataset: pd.DataFrame = get_dataset_from_arrays(orig=frontier[0],
+                                                           dest=frontier[1],
+                                                           values=frontier[2],
+                                                           spine=Tree.spine,
+                                                           geo_level=geo_level)
+
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        # the run is complete, a new run with the same checkpoint starts from the root
+        os.remove(checkpoint_path)
+    if stats is not None:
+        stats.flush()
     end: float = time.time()
     print(f"Time took to create the dataset: {end - start:.2f} seconds")
     print("Done!")
     return dp_dataset
+
+
+def _optimize_chunk(Tree: OD_tree,
+                    level: int,
+                    dp_mechanism: dp.Measurement,
+                    optimizer: callable,
+                    chunk: tuple,
+                    q: ChildQuery = None,
+                    stats: Instrumentation = None) -> tuple:
+    """
+    Noise and optimize the children of a chunk of parents, one parent at a time
+    :param Tree: OD_tree object containing a tree structure.
+    :param level: int, level of the children
+    :param dp_mechanism: dp.Measurement, Gaussian mechanism of the level
+    :param optimizer: callable, optimizer taking the noisy children and the constraint of the parent
+    :param chunk: tuple, (origin codes, destination codes, constraints) of the parents
+    :param q: ChildQuery, children of the chunk if already queried
+    :param stats: Instrumentation, measurements of the run, None to skip them
+    :return: tuple, (origin codes, destination codes, constraints) of the non-zero children
+    """
+    parent_orig, parent_dest, constraints = chunk
+    if stats is not None:
+        stats.reset_lap()
+    if q is None:
+        q: ChildQuery = Tree.full_child_query_level_batch(level=level - 1, nodes=(parent_orig, parent_dest))
+    if stats is not None:
+        stats.lap(level, "query")
+        stats.add_children(level, np.diff(q.offsets))
+        stats.add_optimizer_calls(level, optimizer, len(constraints))
+    bar_q_values: np.array = np.zeros(len(q.values), dtype=np.int64)
+    for k, (nodes, constraint) in enumerate(zip(zip(parent_orig.tolist(), parent_dest.tolist()),
+                                                constraints.tolist())):
+        children = slice(q.offsets[k], q.offsets[k + 1])
+        # Apply differential privacy mechanism
+        if isinstance(dp_mechanism, KeyedGaussianNoise):
+            dp_q_c_values: np.array = dp_mechanism(q.values[children], nodes).astype(int)
+        else:
+            dp_q_c_values: np.array = np.asarray(dp_mechanism(q.values[children])).astype(int)
+        if stats is not None:
+            stats.lap(level, "noise")
+        # Apply optimization
+        bar_q_values[children] = optimizer(dp_q_c_values, constraint)
+        if stats is not None:
+            stats.lap(level, "optimization")
+    # Post process the data, remove zero values
+    non_zero = bar_q_values > 0
+    bar_q: tuple = q.orig[non_zero], q.dest[non_zero], bar_q_values[non_zero]
+    if stats is not None:
+        stats.lap(level, "post_processing")
+    return bar_q
+
+
+def _optimize_chunk_sparse(Tree: OD_tree,
+                           level: int,
+                           dp_mechanism: KeyedGaussianNoise,
+                           optimizer: callable,
+                           chunk: tuple,
+                           stats: Instrumentation = None) -> tuple:
+    """
+    Noise and optimize the children of a chunk of parents as _optimize_chunk, with the optimizer run only on the
+    children returned by _sparse_noise. The other children are projected to zero, so the release has the same
+    distribution of _optimize_chunk and the cost depends on the non-zero children.
+    :param Tree: OD_tree object containing a tree structure.
+    :param level: int, level of the children
+    :param dp_mechanism: KeyedGaussianNoise or BufferedGaussianNoise, noise of the level
+    :param optimizer: callable, l2_simplex_opt
+    :param chunk: tuple, (origin codes, destination codes, constraints) of the parents
+    :param stats: Instrumentation, measurements of the run, None to skip them
+    :return: tuple, (origin codes, destination codes, constraints) of the non-zero children
+    """
+    parent_orig, parent_dest, constraints = chunk
+    if stats is not None:
+        stats.reset_lap()
+        stats.add_optimizer_calls(level, optimizer, len(constraints))
+    bar_q: list = [_empty_frontier()]
+    for nodes, constraint in zip(zip(parent_orig.tolist(), parent_dest.tolist()), constraints.tolist()):
+        positions, values, size = Tree.sparse_child_query_level(level - 1, nodes)
+        if stats is not None:
+            stats.lap(level, "query")
+            stats.add_children(level, [size])
+        positions, dp_q_c_values = _sparse_noise(dp_mechanism, nodes, constraint, positions, values, size)
+        if stats is not None:
+            stats.lap(level, "noise")
+        # Apply optimization
+        bar_q_c_values: np.array = optimizer(dp_q_c_values, constraint)
+        if stats is not None:
+            stats.lap(level, "optimization")
+        # Post process the data, remove zero values
+        non_zero = np.asarray(bar_q_c_values) > 0
+        orig_start, _, dest_start, dest_end = Tree._get_children_range(level - 1, nodes)
+        bar_q.append(((orig_start + positions[non_zero] // (dest_end - dest_start)).astype(np.int32),
+                      (dest_start + positions[non_zero] % (dest_end - dest_start)).astype(np.int32),
+                      np.asarray(bar_q_c_values)[non_zero].astype(np.int64)))
+        if stats is not None:
+            stats.lap(level, "post_processing")
+    return tuple(np.concatenate(x) for x in zip(*bar_q))
+
+
+def _sparse_noise(dp_mechanism: KeyedGaussianNoise, nodes: tuple, constraint: int, positions: np.ndarray,
+                  values: np.ndarray, size: int) -> tuple:
+    """
+    Noise the children of a parent pair drawing explicitly only the non-zero children and the zero children whose
+    noise can be above the threshold of the projection on the constraint. The noise of the zero children is drawn in
+    aggregate: how many are above a cutoff, which ones and their noise, with the exact conditional distribution. The
+    threshold t of the projection of the explicit children is certified if t >= cutoff: every other child is <= t, so
+    it is zero in the projection of the full vector and t is its threshold too. Otherwise, the zero children in
+    (floor(t), cutoff] are drawn as well; adding children can only raise the threshold, so the new one is certified.
+    :param dp_mechanism: KeyedGaussianNoise or BufferedGaussianNoise, noise of the level
+    :param nodes: tuple, (origin code, destination code) of the parent pair
+    :param constraint: int, constraint of the parent pair
+    :param positions: np.ndarray, positions of the non-zero children, see OD_tree.sparse_child_query_level
+    :param values: np.ndarray, values of the non-zero children
+    :param size: int, number of children
+    :return: sorted positions of the explicit children in the vector of full_child_query_level, and their noisy values
+    """
+    tail = dp_mechanism.tail
+    rng = dp_mechanism.get_generator(nodes) if isinstance(dp_mechanism, KeyedGaussianNoise) else dp_mechanism.rng
+    noisy_values = values.astype(np.int64) + sample_discrete_gaussian(dp_mechanism.scale, len(values), rng)
+    # zero children above the cutoff, about as many as the non-zero children
+    cutoff = tail.get_cutoff(size - len(positions), len(positions) + 1)
+    revealed, noise = tail.reveal(size - len(positions), cutoff, tail.bound, rng)
+    revealed = _get_complement(positions, revealed)
+    positions, noisy_values = np.concatenate((positions, revealed)), np.concatenate((noisy_values, noise))
+    threshold = simplex_threshold(noisy_values, constraint)
+    if threshold < cutoff:
+        # the zero children not drawn yet have noise <= cutoff
+        taken = np.sort(positions)
+        more, noise = tail.reveal(size - len(taken), np.floor(threshold), cutoff, rng)
+        positions = np.concatenate((positions, _get_complement(taken, more)))
+        noisy_values = np.concatenate((noisy_values, noise))
+    order = np.argsort(positions)
+    return positions[order], noisy_values[order]
+
+
+def _get_complement(taken: np.ndarray, indices: np.ndarray) -> np.ndarray:
+    """
+    Return the positions of the indices-th elements of the positions not in taken
+    :param taken: np.ndarray, sorted positions
+    :param indices: np.ndarray, sorted indices in the complement of taken
+    """
+    return indices + np.searchsorted(taken - np.arange(len(taken)), indices, side="right")
+
+
+def _optimize_level_vectorized(Tree: OD_tree,
+                               level: int,
+                               dp_mechanism: dp.Measurement,
+                               frontier: tuple,
+                               batch_size: int,
+                               show_tqdm: bool,
+                               stats: Instrumentation = None,
+                               pipeline: int = 0,
+                               consumers: int = 1) -> tuple:
+    """
+    Noise and optimize all the children of a level with flat arrays, one chunk of parents at a time with
+    _optimize_chunk_vectorized. With the same noise the result is the one of the node engine with fast_int_opt, in the
+    same order.
+    :param Tree: OD_tree object containing a tree structure.
+    :param level: int, level of the children
+    :param dp_mechanism: dp.Measurement, Gaussian mechanism of the level
+    :param frontier: tuple, (origin codes, destination codes, constraints) of the parents
+    :param batch_size: int, number of parents of each chunk
+    :param show_tqdm: bool, show the progress bar
+    :param stats: Instrumentation, measurements of the run, None to skip them
+    :param pipeline: int, number of chunks queried ahead by _optimize_chunks_pipelined, 0 to process them in turn
+    :param consumers: int, number of threads noising and optimizing the chunks of the pipeline
+    :return: tuple, (origin codes, destination codes, constraints) of the non-zero children
+    """
+    progress_bar = tqdm.tqdm(total=len(frontier[2]), colour='green') if show_tqdm else None
+    children: list = [_empty_frontier()]
+    chunks: list = [tuple(x[chunk_start:chunk_start + batch_size] for x in frontier)
+                    for chunk_start in range(0, len(frontier[2]), batch_size)]
+    if pipeline > 0:
+        optimize_chunk: callable = partial(_optimize_chunk_vectorized, Tree, level, dp_mechanism)
+        results = _optimize_chunks_pipelined(Tree, level, optimize_chunk, chunks, (chunk[:2] for chunk in chunks),
+                                             pipeline, consumers, stats)
+    else:
+        results = ((_optimize_chunk_vectorized(Tree, level, dp_mechanism, chunk, stats=stats), None)
+                   for chunk in chunks)
+    for chunk, (bar_q_c, chunk_levels) in zip(chunks, results):
+        children.append(bar_q_c)
+        if chunk_levels is not None:
+            stats.merge(chunk_levels)
+        if progress_bar is not None:
+            progress_bar.update(len(chunk[2]))
+    if progress_bar is not None:
+        progress_bar.close()
+    return tuple(np.concatenate(x) for x in zip(*children))
+
+
+def _optimize_chunk_vectorized(Tree: OD_tree, level: int, dp_mechanism: dp.Measurement, chunk: tuple,
+                               q: ChildQuery = None, stats: Instrumentation = None) -> tuple:
+    """
+    Noise and optimize the children of a chunk of parents with flat arrays: the children are queried with one batched
+    query, noised with one call of the mechanism and optimized with segmented_fast_int_opt
+    :param Tree: OD_tree object containing a tree structure.
+    :param level: int, level of the children
+    :param dp_mechanism: dp.Measurement, Gaussian mechanism of the level
+    :param chunk: tuple, (origin codes, destination codes, constraints) of the parents
+    :param q: ChildQuery, children of the chunk if already queried
+    :param stats: Instrumentation, measurements of the run, None to skip them
+    :return: tuple, (origin codes, destination codes, constraints) of the non-zero children
+    """
+    parent_orig, parent_dest, constraints = chunk
+    if stats is not None:
+        stats.reset_lap()
+    if q is None:
+        q: ChildQuery = Tree.full_child_query_level_batch(level=level - 1, nodes=(parent_orig, parent_dest))
+    if stats is not None:
+        stats.lap(level, "query")
+        stats.add_children(level, np.diff(q.offsets))
+        stats.add_optimizer_calls(level, segmented_fast_int_opt, 1)
+    # Apply differential privacy mechanism
+    if isinstance(dp_mechanism, KeyedGaussianNoise):
+        dp_q_values: np.array = dp_mechanism.segments(q.values, q.offsets, parent_orig, parent_dest)
+    else:
+        dp_q_values: np.array = np.asarray(dp_mechanism(q.values)).astype(np.int64)
+    if stats is not None:
+        stats.lap(level, "noise")
+    # Apply optimization
+    bar_q_values: np.array = segmented_fast_int_opt(dp_q_values, q.offsets, constraints)
+    if stats is not None:
+        stats.lap(level, "optimization")
+    # Post process the data, remove zero values
+    non_zero = bar_q_values > 0
+    bar_q: tuple = q.orig[non_zero], q.dest[non_zero], bar_q_values[non_zero]
+    if stats is not None:
+        stats.lap(level, "post_processing")
+    return bar_q
+
+
+def _optimize_chunks_pipelined(Tree: OD_tree, level: int, optimize_chunk: callable, chunks: list, nodes: iter,
+                               pipeline: int, consumers: int, stats: Instrumentation = None) -> iter:
+    """
+    Producer/consumer execution of the chunks of a level: the caller thread queries the children of each chunk and
+    hands them to a pool of consumer threads, which noise and optimize them. At most pipeline chunks are queried and
+    not yet returned, so the producer waits for the oldest chunk when the queue is full, and the results are returned
+    in the order of the chunks. The queries and the solvers (NumPy, OpenDP, the LP solvers) release the GIL for most
+    of their work, so the query of the next chunks is hidden behind the optimization of the previous ones.
+    :param Tree: OD_tree object containing a tree structure.
+    :param level: int, level of the children
+    :param optimize_chunk: callable, receives a chunk, its ChildQuery (q) and an Instrumentation (stats)
+    :param chunks: list, chunks of parents
+    :param nodes: iter, (origin codes, destination codes) of the parents of each chunk
+    :param pipeline: int, maximum number of chunks queried ahead
+    :param consumers: int, number of consumer threads
+    :param stats: Instrumentation, measurements of the run, None to skip them
+    :return: iter, (result of optimize_chunk, levels of the Instrumentation of the chunk or None) for each chunk
+    """
+    queue: deque = deque()
+    with ThreadPoolExecutor(max_workers=consumers) as executor:
+        for chunk, chunk_nodes in zip(chunks, nodes):
+            if len(queue) >= pipeline:
+                yield queue.popleft().result()
+            if stats is not None:
+                stats.reset_lap()
+            q: ChildQuery = Tree.full_child_query_level_batch(level=level - 1, nodes=chunk_nodes)
+            if stats is not None:
+                stats.lap(level, "query")
+            queue.append(executor.submit(_consume_chunk, optimize_chunk, chunk, q, stats is not None))
+        while queue:
+            yield queue.popleft().result()
+
+
+def _consume_chunk(optimize_chunk: callable, chunk, q: ChildQuery, instrument: bool) -> tuple:
+    """
+    Run optimize_chunk in a consumer thread of _optimize_chunks_pipelined, with its own Instrumentation. The peak
+    memory of the thread is the one of the process, recorded by the main thread
+    :return: tuple, result of the chunk and, if instrument, the levels of the Instrumentation of the chunk (else None)
+    """
+    stats: Instrumentation = Instrumentation() if instrument else None
+    return optimize_chunk(chunk, q=q, stats=stats), None if stats is None else stats.levels
+
+
+def _empty_frontier() -> tuple:
+    """
+    Return a frontier, (origin codes, destination codes, constraints), without parents
+    """
+    return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int64)
+
+
+def _optimize_subtrees(Tree: OD_tree,
+                       first_level: int,
+                       final_level: int,
+                       dp_mechanisms: list,
+                       optimizer: callable,
+                       engine: str,
+                       frontier: tuple,
+                       batch_size: int,
+                       sink: callable,
+                       stats: Instrumentation = None):
+    """
+    Depth-first traversal of the tree: a chunk of parents is noised and optimized, then the chunks of its children are
+    processed before the next chunk of parents of the same level. The leaves are sent to the sink as soon as they are
+    released, so the memory holds only the chunks along one path from the root to the leaves. Each parent is still
+    noised once with the mechanism of its level, so the release has the same distribution of the breadth-first one.
+    :param Tree: OD_tree object containing a tree structure.
+    :param first_level: int, level of the children of the frontier
+    :param final_level: int, level of the leaves
+    :param dp_mechanisms: list, Gaussian mechanism of each level (the first one is for level 1)
+    :param optimizer: callable, optimizer of the node engine
+    :param engine: str, "node", "vectorized" or "sparse"
+    :param frontier: tuple, (origin codes, destination codes, constraints) of the parents at first_level - 1
+    :param batch_size: int, number of parents of each chunk
+    :param sink: callable, receives the (origin codes, destination codes, flows) of each chunk of leaves
+    :param stats: Instrumentation, measurements of the run, None to skip them
+    """
+    # chunks to process, the last one is processed first
+    stack: list = [(first_level, frontier)]
+    while stack:
+        level, chunk = stack.pop()
+        if engine == "vectorized":
+            children = _optimize_chunk_vectorized(Tree, level, dp_mechanisms[level - 1], chunk, stats=stats)
+        else:
+            optimize_chunk: callable = _optimize_chunk_sparse if engine == "sparse" else _optimize_chunk
+            children = optimize_chunk(Tree, level, dp_mechanisms[level - 1], optimizer, chunk, stats=stats)
+        if stats is not None:
+            # the levels are interleaved, the peak memory of each level is the largest of its chunks
+            stats.end_level(level)
+        if level == final_level:
+            sink(children)
+        else:
+            # push the chunks of children in reverse order, so they are processed in order
+            for chunk_start in reversed(range(0, len(children[2]), batch_size)):
+                stack.append((level + 1, tuple(x[chunk_start:chunk_start + batch_size] for x in children)))
+
+
+# state of a worker process of the pool, set once by _init_worker
+_worker: dict = {}
+
+
+def _init_worker(Tree: OD_tree, make_noise: callable, budget_list: list[float], optimizer: callable, engine: str):
+    """
+    Initialize a worker process of the pool with the tree and the parameters of the mechanism
+    """
+    _worker.update(Tree=Tree, make_noise=make_noise, budget_list=budget_list, optimizer=optimizer,
+                   optimize_chunk=_optimize_chunk_sparse if engine == "sparse" else _optimize_chunk,
+                   level=None, dp_mechanism=None)
+
+
+def _optimize_chunk_in_worker(level: int, instrument: bool, chunk: tuple) -> tuple:
+    """
+    Run _optimize_chunk in a worker process. The Gaussian mechanism of the level is instantiated in the worker, so
+    that each process samples the noise on its own
+    :return: tuple, result of the chunk and, if instrument, the levels of the Instrumentation of the chunk, with the
+             peak memory of the worker (else None)
+    """
+    if _worker["level"] != level:
+        _worker["dp_mechanism"] = _worker["make_noise"](budget=_worker["budget_list"][level - 1], level=level)
+        _worker["level"] = level
+    stats: Instrumentation = Instrumentation() if instrument else None
+    if stats is not None:
+        # peak memory of the worker from the start of the chunk
+        stats.start("TDA")
+    bar_q: tuple = _worker["optimize_chunk"](_worker["Tree"], level, _worker["dp_mechanism"], _worker["optimizer"],
+                                             chunk, stats=stats)
+    if stats is not None:
+        # peak memory of the worker, the run reports the largest of the processes
+        stats.end_level(level)
+    return bar_q, None if stats is None else stats.levels
+
+
+def _get_options(args: argparse.Namespace) -> tuple:
+    """
+    Return the optimizer, the engine, the noise and the seed of a TDA run, checking that they can be used together
+    :param args: argparse.Namespace containing the input arguments of TDA or MultiTDA
+    :return: tuple, (optimizer, engine, noise, seed)
+    """
+    # get optimizer
+    if args.optimizer == "fast_int_opt":
+        optimizer = fast_int_opt
+    elif args.optimizer == "standard_int":
+        optimizer = partial(standard_int_opt, p=args.p)
+    elif args.optimizer == "l2_simplex":
+        # the integer projection of standard_int with p=2, by sorting instead of a solver
+        optimizer = l2_simplex_opt
+    else:
+        raise ValueError(f"Invalid optimizer: {args.optimizer}")
+
+    # engine processing each level: "node" noises and optimizes the children of one parent at a time, "vectorized"
+    # processes the children of a whole chunk of parents as flat arrays (only with fast_int_opt), "sparse" is the node
+    # engine drawing explicitly only the noise of the zero children that can be non-zero after the optimization (only
+    # with l2_simplex, which never gives units to the children outside the support of the projection, and the keyed or
+    # native noise)
+    engine: str = vars(args).get('engine', 'node')
+    if engine == "vectorized" and optimizer is not fast_int_opt:
+        raise ValueError(f"The vectorized engine supports only the fast_int_opt optimizer, got {args.optimizer}")
+    elif engine == "sparse" and optimizer is not l2_simplex_opt:
+        raise ValueError(f"The sparse engine supports only the l2_simplex optimizer, got {args.optimizer}")
+    elif engine not in ["node", "vectorized", "sparse"]:
+        raise ValueError(f"Invalid engine: {engine}")
+
+    # noise: "opendp" samples with the OpenDP measurement, "keyed" with a generator keyed by (seed, level, parent
+    # pair), so that the release depends only on the seed and not on how the parents are processed, "native" with
+    # blocks of samples drawn in advance (optionally checked against OpenDP with noise_check)
+    noise: str = vars(args).get('noise', 'opendp')
+    seed: int = vars(args).get('seed', None)
+    if noise == "keyed" and seed is None:
+        raise ValueError("The keyed noise needs a seed")
+    elif noise not in ["opendp", "keyed", "native"]:
+        raise ValueError(f"Invalid noise: {noise}")
+    elif engine == "sparse" and noise == "opendp":
+        raise ValueError("The sparse engine needs the keyed or the native noise")
+    return optimizer, engine, noise, seed
+
+
+def _make_noise(sensitivity: float, budget: float, level: int, noise: str, seed: int, check: bool = False):
+    """
+    Return the noise of a level: the OpenDP Gaussian measurement, the keyed or the buffered discrete Gaussian noise,
+    with the same scale
+    :param sensitivity: float, l2 sensitivity
+    :param budget: float, budget of the level (rho in zCDP)
+    :param level: int, level of the children
+    :param noise: str, "opendp", "keyed" or "native"
+    :param seed: int, seed of the run for the keyed and the native noise
+    :param check: bool, check the calibration of the native noise against OpenDP
+    """
+    if noise == "keyed":
+        return make_keyed_gaussian_noise(d_in=sensitivity, budget=budget, seed=seed, level=level)
+    elif noise == "native":
+        return make_buffered_gaussian_noise(d_in=sensitivity, budget=budget,
+                                            seed=None if seed is None else [seed, level], check=check)
+    return make_gaussian_noise(d_in=sensitivity, budget=budget, dtype=int)
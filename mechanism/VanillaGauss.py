@@ -3,15 +3,21 @@ import numpy as np
 import argparse
 import time
 import opendp as dp
-from data_structure.tree import OD_tree
-from data_structure.utils import get_dataset_from_dict
+from data_structure.tree import OD_tree, SparseQuery
+from data_structure.utils import get_dataset_from_arrays
 from differential_privacy import make_gaussian_noise
 from differential_privacy import get_rho_from_budget
+from .instrumentation import Instrumentation
 
 
 def VanillaGauss(Tree: OD_tree, args: argparse.Namespace) -> pd.DataFrame:
     start: float = time.time()
 
+    # measurements of the level, sent to its sink at the end of the run
+    stats: Instrumentation = vars(args).get('instrumentation', None)
+    if stats is not None:
+        stats.start("VanillaGauss")
+
     # define privacy budget
     epsilon: float = float(args.epsilon)
     delta: float = float(args.delta)
@@ -27,21 +33,47 @@ def VanillaGauss(Tree: OD_tree, args: argparse.Namespace) -> pd.DataFrame:
 
     # instantiate the mechanism
     dp_mechanism: dp.Measurement = make_gaussian_noise(d_in=sensitivity, budget=rho, dtype=int)
-    # get dataset (use full histogram as we need also the zero counts)
+    # get dataset (the full histogram is needed to add noise also to the zero counts, but it is stored sparsely)
     print("Querying the full histogram")
-    data: pd.Series = Tree.full_query_level(level=final_level)
-    # apply the mechanism
+    data: SparseQuery = Tree.sparse_query_level(level=final_level)
+    size: int = data.shape[0] * data.shape[1]
+    if stats is not None:
+        stats.lap(final_level, "query")
+        # a single parent, the whole histogram
+        stats.add_children(final_level, [size])
+    # apply the mechanism to the dense histogram, one chunk at a time
     print("Applying the DP mechanism")
-    dp_data_values = dp_mechanism(data.values)
-    # post process (get a dictionary) and remove zero counts but keep negative values
-    dp_data_dict: dict = {key: value for key, value in zip(data.index, dp_data_values) if value != 0}
+    chunk_size: int = vars(args).get('chunk_size', 2 ** 20)
+    dp_positions: list = [np.zeros(0, dtype=np.int64)]
+    dp_values: list = [np.zeros(0, dtype=np.int64)]
+    for chunk_start in range(0, size, chunk_size):
+        chunk_end = min(chunk_start + chunk_size, size)
+        dense_chunk: np.array = data.to_dense(chunk_start, chunk_end).astype(np.int64)
+        if stats is not None:
+            stats.lap(final_level, "query")
+        dp_chunk_values = np.array(dp_mechanism(dense_chunk))
+        if stats is not None:
+            stats.lap(final_level, "noise")
+        # post process, remove zero counts but keep negative values
+        non_zero = np.flatnonzero(dp_chunk_values)
+        dp_positions.append(non_zero + chunk_start)
+        dp_values.append(dp_chunk_values[non_zero])
+        if stats is not None:
+            stats.lap(final_level, "post_processing")
+    positions: np.array = np.concatenate(dp_positions)
     # create dataset
     print("Creating the dataset")
-    # the final constraint is a dictionary containing (leaf node, leaf node) as key and the flow as value
-    geo_level = int(final_level/2)
-    dp_dataset: pd.DataFrame = get_dataset_from_dict(data_dict=dp_data_dict,
-                                                     spine=Tree.spine,
-                                                     geo_level=geo_level)
+    # the final constraint contains (leaf node, leaf node) pairs and their flow
+    geo_level = Tree.get_geo_level(final_level)
+    dp_dataset: pd.DataFrame = get_dataset_from_arrays(orig=positions // data.shape[1],
+                                                       dest=positions % data.shape[1],
+                                                       values=np.concatenate(dp_values),
+                                                       spine=Tree.spine,
+                                                       geo_level=geo_level)
+    if stats is not None:
+        stats.lap(final_level, "post_processing")
+        stats.end_level(final_level, time.time() - start)
+        stats.flush()
     end: float = time.time()
     print(f"Time took to create the dataset: {end - start:.2f} seconds")
     return dp_dataset
@@ -6,12 +6,18 @@ import opendp as dp
 from data_structure.tree import OD_tree
 from data_structure.utils import get_dataset_from_dict
 from differential_privacy import make_stability_histogram
+from .instrumentation import Instrumentation
 import ast
 
 
 def VanillaSH(Tree: OD_tree, args: argparse.Namespace) -> tuple[pd.DataFrame, float]:
     start: float = time.time()
 
+    # measurements of the level, sent to its sink at the end of the run
+    stats: Instrumentation = vars(args).get('instrumentation', None)
+    if stats is not None:
+        stats.start("VanillaSH")
+
     # define privacy budget
     epsilon: float = float(args.epsilon)
     delta: float = float(args.delta)
@@ -30,9 +36,15 @@ def VanillaSH(Tree: OD_tree, args: argparse.Namespace) -> tuple[pd.DataFrame, fl
     print("Querying the full histogram")
     data: pd.Series = Tree.stable_query_level(args.final_level)
     data_dict: dict = pre_process(data=data)
+    if stats is not None:
+        stats.lap(final_level, "query")
+        # a single parent, the non-zero cells of the histogram
+        stats.add_children(final_level, [len(data_dict)])
     # apply the mechanism
     print("Applying the DP mechanism")
     dp_data_dict: dict = dp_mechanism(data_dict)
+    if stats is not None:
+        stats.lap(final_level, "noise")
     # round the counts
     dp_data_dict = {key: round(value) for key, value in dp_data_dict.items() if round(value) > 0}
     # post process
@@ -41,10 +53,14 @@ def VanillaSH(Tree: OD_tree, args: argparse.Namespace) -> tuple[pd.DataFrame, fl
     # create dataset
     print("Creating the dataset")
     # the final constraint is a dictionary containing (leaf node, leaf node) as key and the flow as value
-    geo_level = int(final_level / 2)
+    geo_level = Tree.get_geo_level(final_level)
     dp_dataset: pd.DataFrame = get_dataset_from_dict(data_dict=dp_data_dict,
                                                      spine=Tree.spine,
                                                      geo_level=geo_level)
+    if stats is not None:
+        stats.lap(final_level, "post_processing")
+        stats.end_level(final_level, time.time() - start)
+        stats.flush()
     end: float = time.time()
     print(f"Time took to create the dataset: {end - start:.2f} seconds")
     return dp_dataset
@@ -1,3 +1,6 @@
 from .VanillaGauss import VanillaGauss
 from .VanillaSH import VanillaSH
-from .TDA import TDA
\ No newline at end of file
+from .TDA import TDA
+from .ShardedTDA import ShardedTDA
+from .MultiTDA import MultiTDA
+from .instrumentation import Instrumentation
@@ -0,0 +1,212 @@
+import json
+import time
+import numpy as np
+
+# phases of the time of each level
+PHASES = ("query", "noise", "optimization", "post_processing")
+
+
+class Instrumentation:
+    """
+    Measurements of a run of a mechanism, level by level: number of parents, distribution of the sizes of the child
+    vectors, time of each phase (query, noise, optimization, post-processing), calls of each optimizer and peak memory
+    of the level (only where the peak of the process can be reset, i.e. on Linux).
+    The mechanisms receive it as args.instrumentation and send one record per level to the sink at the end of the run.
+    """
+
+    def __init__(self, sink: callable = None):
+        """
+        :param sink: callable receiving each record (a dict), e.g. MemorySink or JSONLinesSink
+        """
+        self.sink = sink
+        self.mechanism: str = None
+        self.levels: dict[int, dict] = {}
+        self._lap: float = time.perf_counter()
+        # True when the peak memory of the process is reset at the start of the run and after each level
+        self._peak_per_level: bool = False
+
+    def start(self, mechanism: str):
+        """
+        Start the measurements of a run, the levels of the previous run are discarded. The peak memory of the process
+        is reset, so that each level reports its own peak. Call it only from the main thread of a process
+        :param mechanism: str, name of the mechanism
+        """
+        self.mechanism = mechanism
+        self.levels = {}
+        self.reset_lap()
+        self._peak_per_level = reset_peak_memory()
+
+    def _get_level(self, level: int) -> dict:
+        if level not in self.levels:
+            self.levels[level] = {"parents": 0, "sizes": [], "optimizer_calls": {}, "time_total": None,
+                                  "peak_memory_mb": None, **{"time_" + phase: 0. for phase in PHASES}}
+        return self.levels[level]
+
+    def reset_lap(self):
+        """
+        Start measuring the time of the next phase
+        """
+        self._lap = time.perf_counter()
+
+    def lap(self, level: int, phase: str):
+        """
+        Add the time since the last lap to a phase of a level
+        :param level: int, level of the tree
+        :param phase: str, one of PHASES
+        """
+        now = time.perf_counter()
+        self._get_level(level)["time_" + phase] += now - self._lap
+        self._lap = now
+
+    def add_children(self, level: int, sizes: np.ndarray):
+        """
+        Add parents to a level
+        :param level: int, level of the children
+        :param sizes: np.ndarray, size of the child vector of each parent
+        """
+        record = self._get_level(level)
+        record["parents"] += len(sizes)
+        record["sizes"].append(np.asarray(sizes, dtype=np.int64))
+
+    def add_optimizer_calls(self, level: int, optimizer: callable, calls: int):
+        """
+        Add calls of an optimizer to a level
+        :param level: int, level of the children
+        :param optimizer: callable, the optimizer, partial functions are named with their keywords
+        :param calls: int, number of calls
+        """
+        name = get_optimizer_name(optimizer)
+        optimizer_calls = self._get_level(level)["optimizer_calls"]
+        optimizer_calls[name] = optimizer_calls.get(name, 0) + calls
+
+    def end_level(self, level: int, time_total: float = None):
+        """
+        Record the peak memory since the last reset (the start of the run or the previous call) and, if measured, the
+        wall time of the whole level. The peak memory of the level is the largest of its calls and of the processes,
+        with the peaks of the workers added by merge
+        """
+        record = self._get_level(level)
+        if self._peak_per_level:
+            record["peak_memory_mb"] = _get_max(record["peak_memory_mb"], get_peak_memory())
+            reset_peak_memory()
+        if time_total is not None:
+            record["time_total"] = (record["time_total"] or 0.) + time_total
+
+    def merge(self, levels: dict[int, dict], children: bool = True):
+        """
+        Add the measurements of another Instrumentation, e.g. of a worker process, keeping the largest peak memory
+        :param levels: dict, levels of the other Instrumentation
+        :param children: bool, False to skip its parents and child vectors, e.g. when they are shared with other runs
+                         and recorded once
+        """
+        for level, other in levels.items():
+            record = self._get_level(level)
+            if children:
+                record["parents"] += other["parents"]
+                record["sizes"] += other["sizes"]
+            for phase in PHASES:
+                record["time_" + phase] += other["time_" + phase]
+            for name, calls in other["optimizer_calls"].items():
+                record["optimizer_calls"][name] = record["optimizer_calls"].get(name, 0) + calls
+            record["peak_memory_mb"] = _get_max(record["peak_memory_mb"], other["peak_memory_mb"])
+
+    def flush(self) -> list[dict]:
+        """
+        Send one record per level to the sink
+        :return: list[dict], the records
+        """
+        records = []
+        for level in sorted(self.levels):
+            measurements = self.levels[level]
+            sizes = np.concatenate([np.zeros(0, dtype=np.int64)] + measurements["sizes"])
+            record = {"mechanism": self.mechanism, "level": level, "parents": measurements["parents"],
+                      "children": int(sizes.sum())}
+            for name, statistic in (("min", np.min), ("mean", np.mean), ("median", np.median), ("max", np.max)):
+                record["children_" + name] = float(statistic(sizes)) if len(sizes) > 0 else 0.
+            record["children_p99"] = float(np.percentile(sizes, 99)) if len(sizes) > 0 else 0.
+            for phase in PHASES:
+                record["time_" + phase] = measurements["time_" + phase]
+            # without the wall time of the level (e.g. depth-first traversal) the total is the sum of the phases
+            record["time_total"] = measurements["time_total"] if measurements["time_total"] is not None else \
+                sum(measurements["time_" + phase] for phase in PHASES)
+            record["optimizer_calls"] = dict(measurements["optimizer_calls"])
+            record["peak_memory_mb"] = measurements["peak_memory_mb"]
+            records.append(record)
+            if self.sink is not None:
+                self.sink(record)
+        return records
+
+
+class MemorySink:
+    """
+    Sink keeping the records in memory, e.g. to store them in the results pickle
+    """
+
+    def __init__(self):
+        self.records: list[dict] = []
+
+    def __call__(self, record: dict):
+        self.records.append(record)
+
+
+class JSONLinesSink:
+    """
+    Sink appending each record to a JSON lines file
+    """
+
+    def __init__(self, file_path: str):
+        """
+        :param file_path: str, path of the file, the records are appended
+        """
+        self.file_path = file_path
+
+    def __call__(self, record: dict):
+        with open(self.file_path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+def get_optimizer_name(optimizer: callable) -> str:
+    """
+    Return the name of an optimizer, with the keywords of a partial function (e.g. standard_int_opt(p=2))
+    """
+    function = getattr(optimizer, "func", optimizer)
+    keywords = getattr(optimizer, "keywords", {})
+    name = getattr(function, "__name__", type(function).__name__)
+    if keywords:
+        name += "(" + ", ".join(f"{key}={value}" for key, value in keywords.items()) + ")"
+    return name
+
+
+def reset_peak_memory() -> bool:
+    """
+    Reset the peak resident memory of the process (VmHWM on Linux)
+    :return: bool, False if it cannot be reset
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def get_peak_memory() -> float:
+    """
+    Return the peak resident memory of the process in MB since the last `reset_peak_memory`, None if it is not
+    available
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 2 ** 10
+    except OSError:
+        pass
+    return None
+
+
+def _get_max(a: float, b: float) -> float:
+    """
+    Return the largest of two measurements, None if neither is available
+    """
+    return b if a is None else a if b is None else max(a, b)
@@ -1,4 +1,9 @@
+import os
+import json
 import numpy as np
+import pandas as pd
+from data_structure.geospine import GeoSpine
+from data_structure.utils import decode_dataset
 
 
 def split_rho_budget(rho: float, T: int, method: str = "uniform", b: int = None):
@@ -19,3 +24,74 @@ def split_rho_budget(rho: float, T: int, method: str = "uniform", b: int = None)
 
     else:
         raise ValueError(f"Invalid method: {method}")
+
+
+class CSVSink:
+    """
+    Sink of a streamed release: each chunk of the dataset is decoded and appended to a CSV file, so the release never
+    needs to be held in memory
+    """
+
+    def __init__(self, file_path: str, spine: GeoSpine):
+        """
+        :param file_path: str, path of the CSV file, it is overwritten
+        :param spine: GeoSpine, spine used to decode the nodes
+        """
+        self.file_path = file_path
+        self.spine = spine
+        self.rows = 0
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+    def __call__(self, dataset: pd.DataFrame):
+        """
+        Append a chunk of the dataset, with the codes of the nodes, to the CSV file
+        """
+        if len(dataset) == 0:
+            return
+        decode_dataset(dataset, self.spine).to_csv(self.file_path, mode="a", header=self.rows == 0, index=False)
+        self.rows += len(dataset)
+
+
+def save_checkpoint(file_path: str, level: int, frontier: tuple, budget_list: list[float], args: dict):
+    """
+    Save the state of TDA after a released level: the post-processed constraints of the level, the budget split and
+    the arguments of the run, in a compressed .npz file. The file is replaced atomically, so a crash while saving
+    leaves the previous checkpoint.
+    :param file_path: str, path of the checkpoint
+    :param level: int, last released level
+    :param frontier: tuple, (origin codes, destination codes, constraints) of the level
+    :param budget_list: list[float], budget of each level
+    :param args: dict, arguments of the run, only the values that can be saved as JSON are kept
+    """
+    args = {key: value for key, value in args.items() if isinstance(value, (str, int, float, bool, type(None)))}
+    temporary_path = file_path + ".tmp.npz"
+    np.savez_compressed(temporary_path,
+                        level=level,
+                        orig=frontier[0],
+                        dest=frontier[1],
+                        constraints=frontier[2],
+                        budget_list=np.array(budget_list, dtype=float),
+                        args=json.dumps(args))
+    os.replace(temporary_path, file_path)
+
+
+def load_checkpoint(file_path: str) -> dict:
+    """
+    Load a checkpoint saved with save_checkpoint
+    :param file_path: str, path of the checkpoint
+    :return: dict with level, frontier, budget_list and args
+    """
+    with np.load(file_path) as checkpoint:
+        return {"level": int(checkpoint["level"]),
+                "frontier": (checkpoint["orig"], checkpoint["dest"], checkpoint["constraints"]),
+                "budget_list": checkpoint["budget_list"].tolist(),
+                "args": json.loads(str(checkpoint["args"]))}
+
+
+def derive_seed(seed: int, *keys: int) -> int:
+    """
+    Return a seed derived from a seed and some non-negative integer keys (e.g. the mechanism, the epsilon and the
+    experiment of a run), so that the runs sharing the same seed are independent
+    """
+    return int(np.random.SeedSequence([seed, *keys]).generate_state(1)[0])
@@ -1,7 +1,7 @@
 import pandas as pd
 from .metrics import (false_discovery_rate, false_negative_rate, CPC, MAE, RMSE, L1, L2, max_absolute_error,
                       error_distribution, standard_deviation)
-from .utils import match_index
+from .utils import match_index, SparseErrors, concatenate_errors
 from data_structure import GeoSpine
 
 METRICS = [false_discovery_rate, false_negative_rate, CPC, MAE, RMSE, L1, L2, max_absolute_error,
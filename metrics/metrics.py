@@ -1,6 +1,6 @@
 import numpy as np
 import pandas as pd
-from .utils import get_levels_from_query
+from .utils import get_levels_from_query, SparseErrors
 from data_structure import GeoSpine
 
 
@@ -84,8 +84,8 @@ def MAE(data_true: pd.DataFrame, dp_data: pd.DataFrame, spine: GeoSpine, workloa
     MAE_list = []
     for query in workload:
         levels = get_levels_from_query(query)
-        number_of_orig_nodes = len(spine.get_nodes(levels[0]))
-        number_of_dest_nodes = len(spine.get_nodes(levels[1]))
+        number_of_orig_nodes = spine.level_size(levels[0])
+        number_of_dest_nodes = spine.level_size(levels[1])
         normalization = number_of_orig_nodes * number_of_dest_nodes
         # get pandas series
         data_true = data_true.groupby(query)[count_str].sum()
@@ -127,8 +127,8 @@ def RMSE(data_true: pd.DataFrame, dp_data: pd.DataFrame, spine: GeoSpine, worklo
     RMSE_list = []
     for query in workload:
         levels = get_levels_from_query(query)
-        number_of_orig_nodes = len(spine.get_nodes(levels[0]))
-        number_of_dest_nodes = len(spine.get_nodes(levels[1]))
+        number_of_orig_nodes = spine.level_size(levels[0])
+        number_of_dest_nodes = spine.level_size(levels[1])
         normalization = number_of_orig_nodes * number_of_dest_nodes
         # get pandas series
         data_true = data_true.groupby(query)[count_str].sum()
@@ -178,10 +178,10 @@ def L2(data_true: pd.DataFrame, dp_data: pd.DataFrame, spine: GeoSpine, workload
 
 
 def error_distribution(data_true: pd.DataFrame, dp_data: pd.DataFrame, spine: GeoSpine,
-                       workload=None) -> list[float]:
+                       workload=None) -> list[SparseErrors]:
     """
     Return the distribution of the error of the released data, accounting also for the zero values not present in
-    the true data
+    the true data. The zero errors are not materialized, see SparseErrors
     :param spine:
     :param data_true: sensitive data
     :param dp_data: private data
@@ -192,19 +192,17 @@ def error_distribution(data_true: pd.DataFrame, dp_data: pd.DataFrame, spine: Ge
     for query in workload:
         # get the total number of data points
         levels = get_levels_from_query(query)
-        number_of_orig_nodes = len(spine.get_nodes(levels[0]))
-        number_of_dest_nodes = len(spine.get_nodes(levels[1]))
+        number_of_orig_nodes = spine.level_size(levels[0])
+        number_of_dest_nodes = spine.level_size(levels[1])
         total_data_points = number_of_orig_nodes * number_of_dest_nodes
         # get pandas series
         data_true: pd.Series = data_true.groupby(query)[count_str].sum()
         dp_data: pd.Series = dp_data.groupby(query)[count_str].sum()
         # get the error distribution
-        absolute_error_distribution_list = list(data_true - dp_data)
-        # add zero counts (where both data_true and dp_data are zero)
-        zero_elements = total_data_points - len(absolute_error_distribution_list)
-        if zero_elements > 0:
-            absolute_error_distribution_list += [0] * zero_elements
-        output.append(absolute_error_distribution_list)
+        absolute_error_distribution = (data_true - dp_data).to_numpy()
+        # the zero counts (where both data_true and dp_data are zero) are implicit
+        output.append(SparseErrors(values=absolute_error_distribution,
+                                   size=max(total_data_points, len(absolute_error_distribution))))
     return output
 
 
@@ -217,7 +215,7 @@ def standard_deviation(data_true: pd.DataFrame, dp_data: pd.DataFrame, spine: Ge
     """
     # works for workload with only one query
     assert len(workload) == 1, "The workload must have only one query"
-    # get pandas series
-    error_list = error_distribution(data_true, dp_data, spine, workload)[0]
-    output = np.std(error_list)
+    # get the errors
+    errors = error_distribution(data_true, dp_data, spine, workload)[0]
+    output = errors.std()
     return output
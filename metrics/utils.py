@@ -1,7 +1,43 @@
+from typing import NamedTuple
+
+import numpy as np
 import pandas as pd
 import re
 
 
+class SparseErrors(NamedTuple):
+    """
+    Errors of a query over all the OD pairs of a level. Only the errors of the OD pairs present in the true or in the
+    private data are stored, the other size - len(values) errors are zero.
+    """
+    values: np.ndarray
+    size: int
+
+    def abs(self) -> "SparseErrors":
+        return SparseErrors(values=np.abs(self.values), size=self.size)
+
+    def mean(self) -> float:
+        return self.values.sum() / self.size
+
+    def std(self) -> float:
+        # population standard deviation, as np.std, computed from the first two moments
+        mean = self.mean()
+        return np.sqrt(max(np.square(self.values, dtype=float).sum() / self.size - mean ** 2, 0))
+
+    def to_dense(self) -> np.ndarray:
+        return np.concatenate([self.values, np.zeros(self.size - len(self.values), dtype=self.values.dtype)])
+
+
+def concatenate_errors(errors: list[SparseErrors]) -> SparseErrors:
+    """
+    Concatenate a list of sparse errors, as np.concatenate on the dense errors
+    :param errors: list[SparseErrors]
+    :return: SparseErrors
+    """
+    return SparseErrors(values=np.concatenate([error.values for error in errors]),
+                        size=sum(error.size for error in errors))
+
+
 def match_index(data_true: pd.DataFrame, dp_data: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
     """
     Match the index of the two dataframes adding zero counts where necessary
@@ -91,7 +91,7 @@ def fast_int_opt(x: np.array(int), c: int) -> np.array:
     # clip
     z = np.maximum(z, -x).astype(int)
     t = max(abs(z))  # smallest value in z that is allowed
-    I = np.argsort(x)  # get indices of x in ascending order
+    I = np.argsort(x, kind="stable")  # get indices of x in ascending order
     I = I[z[I] > -x[I]]
     z_sum = z.sum()
     i = 0
@@ -109,3 +109,119 @@ def fast_int_opt(x: np.array(int), c: int) -> np.array:
             t += max(1, r)
             i = 0
     return z + x
+
+
+def segmented_fast_int_opt(x: np.array(int), offsets: np.array(int), c: np.array(int)) -> np.array:
+    """
+    fast_int_opt applied to many vectors at once: the k-th vector is x[offsets[k]:offsets[k + 1]] with constraint
+    c[k]. The result is the same of calling fast_int_opt on each vector, but every step runs on all the vectors
+    together. Each pass of the while loop of fast_int_opt over I is a greedy reduction in the order of I, computed
+    for all the vectors with a segmented cumulative sum, so the number of NumPy calls depends only on the number of
+    passes.
+    Args:
+        x: np.array: concatenated arrays of integer, every vector must be non-empty
+        offsets: np.array: start of each vector in x, followed by len(x)
+        c: np.array: constraint of each vector
+
+    Returns: y: np.array: concatenated arrays of integer
+
+    """
+    x = np.asarray(x, dtype=np.int64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    c = np.asarray(c, dtype=np.int64)
+    sizes = np.diff(offsets)
+    segment = np.repeat(np.arange(len(sizes)), sizes)
+    starts = offsets[:-1]
+    # sum of each vector
+    x_cumsum = np.concatenate(([0], np.cumsum(x)))
+    x_sum = x_cumsum[offsets[1:]] - x_cumsum[starts]
+    a = (c - x_sum) / sizes
+    constraint = c - x_sum
+    # round
+    a_int = np.ceil(a).astype(np.int64)
+    # clip
+    z = np.maximum(a_int[segment], -x)
+    t = np.maximum.reduceat(np.abs(z), starts)  # smallest value in z that is allowed
+    # indices of x in ascending order within each vector
+    order = np.lexsort((x, segment))
+    z_cumsum = np.concatenate(([0], np.cumsum(z)))
+    excess = z_cumsum[offsets[1:]] - z_cumsum[starts] - constraint
+    I = order[(excess[segment[order]] > 0) & (z[order] > -x[order])]
+    while len(I) > 0:
+        I_segment = segment[I]
+        # reduce the elements of I in order, each as much as possible, until the excess is removed
+        capacity = z[I] - np.maximum(-x[I], -t[I_segment])
+        capacity_cumsum = np.cumsum(capacity)
+        segment_first = np.flatnonzero(np.concatenate(([True], I_segment[1:] != I_segment[:-1])))
+        before = capacity_cumsum - capacity
+        before -= np.repeat(before[segment_first], np.diff(np.append(segment_first, len(I))))
+        reduction = np.clip(excess[I_segment] - before, 0, capacity)
+        z[I] -= reduction
+        excess -= np.bincount(I_segment, weights=reduction, minlength=len(sizes)).astype(np.int64)
+        # vectors with some excess left start a new pass, with the same update of t of fast_int_opt
+        I = I[(excess[I_segment] > 0) & (z[I] > -x[I])]
+        I_segment = segment[I]
+        g = np.bincount(I_segment, minlength=len(sizes))
+        left = np.flatnonzero(excess > 0)
+        if np.any(g[left] == 0):
+            raise ValueError("Constraint cannot be satisfied by non-negative integers")
+        r = ((1 / g[left]) * excess[left]).astype(np.int64)
+        t[left] += np.maximum(1, r)
+    return z + x
+
+
+def simplex_threshold(y: np.array, c: float) -> float:
+    """
+    Threshold of the euclidean projection of y on the non-negative vectors with sum c: the projection is
+    max(y - t, 0), every element of y lower or equal to t is projected to zero.
+    Args:
+        y: np.array: array of numbers
+        c: float: constraint, positive
+
+    Returns: t: float: the threshold, -inf if y is empty
+
+    """
+    if len(y) == 0:
+        return -np.inf
+    y_sorted = np.sort(np.asarray(y, dtype=float))[::-1]
+    excess = np.cumsum(y_sorted) - c
+    # number of positive elements of the projection
+    rho = np.flatnonzero(y_sorted * np.arange(1, len(y) + 1) > excess)[-1]
+    return excess[rho] / (rho + 1)
+
+
+def l2_simplex_opt(y: np.array(int), c: int) -> np.array:
+    """
+    Integer euclidean projection of y on the non-negative vectors with sum c, without a solver: the real projection
+    max(y - t, 0) is found by sorting y (see `simplex_threshold`), then it is rounded with the largest remainder
+    method, so the sum is exactly c. With integer y the threshold is t = s / k, s integer and k the number of positive
+    elements, so the projection and its remainders are computed exactly in integers. The floors of the positive
+    elements sum to c - d with 0 <= d < k, and one unit is added to the d elements with the largest remainder, the
+    first ones in y on ties. The cost of each unit added to the floors decreases with the remainder, so the result is
+    also the non-negative integer vector with sum c closest in L2 to y.
+    Args:
+        y: np.array: array of integer
+        c: int: constraint, non-negative
+
+    Returns: x: np.array: array of non-negative integer with sum c
+
+    """
+    y = np.asarray(y, dtype=np.int64)
+    x = np.zeros(len(y), dtype=np.int64)
+    if c == 0:
+        return x
+    order = np.argsort(-y, kind="stable")
+    y_sorted = y[order]
+    excess = np.cumsum(y_sorted) - c
+    # number of positive elements of the projection, the last k with y_sorted[k - 1] * k > excess[k - 1]
+    k = np.flatnonzero(y_sorted * np.arange(1, len(y) + 1) > excess)[-1] + 1
+    s = excess[k - 1]
+    # projection of the positive elements, (k * y - s) / k, as floor and remainder
+    floor, remainder = np.divmod(k * y_sorted[:k] - s, k)
+    d = c - floor.sum()
+    # largest remainders first, the first elements of y on ties
+    support = order[:k]
+    rounded_up = np.lexsort((support, -remainder))[:d]
+    floor[rounded_up] += 1
+    x[support] = floor
+    return x
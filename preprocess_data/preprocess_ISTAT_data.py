@@ -1,9 +1,15 @@
 import os
+import sys
 import zipfile
 import pandas as pd
 import shutil
 import pickle
 
+sys.path.append('../')
+
+from data_structure import GeoSpine
+from data_structure.utils import save_dataset
+
 """
     It opens all the zip files in the directory and extracts the CSV files. It creates a unique dataframe with all the data
 """
@@ -127,5 +133,13 @@ if not os.path.exists(folder_path):
     os.makedirs(folder_path)
 with open(f'{folder_path}/geo_spine.pickle', 'wb') as handle:
     pickle.dump(geo_spine, handle, protocol=pickle.HIGHEST_PROTOCOL)
+# save the geo_spine also in binary format, it can be memory-mapped by the experiments
+spine = GeoSpine(geo_spine)
+spine.save(f'{folder_path}/geo_spine')
 
 print("Geographical spine constructed and saved successfully")
+
+# save the dataset also in the columnar binary format, with the codes of the spine, it can be memory-mapped by the
+# experiments
+save_dataset(data, "../data/Italy/data", spine)
+print("Columnar dataset saved successfully")
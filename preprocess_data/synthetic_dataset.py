@@ -13,6 +13,7 @@ import pickle
 import random
 import yaml
 from data_structure import GeoSpine
+from data_structure.utils import save_dataset
 import datetime
 from itertools import product
 
@@ -106,10 +107,11 @@ if not os.path.exists(folder_path_2):
 file_name = f"{folder_path_2}/geo_spine.pickle"
 with open(file_name, "wb") as f:
     pickle.dump(geo_spine, f)
-print("Geographical spine saved successfully")
 
-# create GeoSpine object
+# create GeoSpine object and save it also in binary format
 geo_spine = GeoSpine(geo_spine)
+geo_spine.save(f"{folder_path_2}/geo_spine")
+print("Geographical spine saved successfully")
 
 print("Creating the synthetic dataset...")
 # get all possible root to leaf paths
@@ -139,6 +141,8 @@ synthetic_df["COUNT"] = random_flows
 # save the dataset
 file_name = f"{folder_path}/data.csv"
 synthetic_df.to_csv(file_name, index=False)
+# save the dataset also in the columnar binary format, it can be memory-mapped by the experiments
+save_dataset(synthetic_df, f"{folder_path}/data", geo_spine)
 
 # save orig_dest and layers_column
 file_name = f"{folder_path_2}/orig_dest.pickle"
@@ -0,0 +1,31 @@
+import os
+import sys
+import itertools
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from data_structure import GeoSpine, OD_tree
+
+
+def make_dataset(seed: int = 0) -> tuple[pd.DataFrame, GeoSpine]:
+    """
+    Return a small synthetic OD dataset, with about half of the pairs of leaves non-zero, and its spine of depth 2
+    """
+    spine = {1: {3: {}, 4: {}, 5: {}}, 2: {6: {}, 7: {}}}
+    leaves = [(0, region, leaf) for region, children in spine.items() for leaf in children]
+    pairs = list(itertools.product(leaves, leaves))
+    rng = np.random.default_rng(seed)
+    rows = [orig + dest for orig, dest in pairs if rng.random() < 0.6]
+    columns = [f"LEVEL{level}_ORIG" for level in range(3)] + [f"LEVEL{level}_DEST" for level in range(3)]
+    data = pd.DataFrame(rows, columns=columns)
+    data["COUNT"] = rng.integers(1, 50, size=len(data))
+    return data, GeoSpine(spine)
+
+
+@pytest.fixture
+def tree() -> OD_tree:
+    data, spine = make_dataset()
+    return OD_tree(data, spine)
@@ -0,0 +1,35 @@
+import os
+import sys
+import itertools
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from optimization import fast_int_opt, segmented_fast_int_opt, l2_simplex_opt
+
+
+def test_segmented_fast_int_opt_matches_fast_int_opt():
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        sizes = rng.integers(1, 12, size=rng.integers(1, 20))
+        offsets = np.concatenate(([0], np.cumsum(sizes)))
+        x = rng.integers(-20, 40, size=offsets[-1])
+        # the parents with a zero constraint are removed by TDA, the constraints are positive
+        c = rng.integers(1, 100, size=len(sizes))
+        y = segmented_fast_int_opt(x, offsets, c)
+        for k in range(len(sizes)):
+            expected = fast_int_opt(x[offsets[k]:offsets[k + 1]], int(c[k]))
+            assert np.asarray(y[offsets[k]:offsets[k + 1]]).tolist() == np.asarray(expected).tolist()
+
+
+def test_l2_simplex_opt_is_l2_optimal():
+    # the closest non-negative integer vector with sum c, by enumeration of all of them
+    rng = np.random.default_rng(1)
+    for _ in range(300):
+        n, c = int(rng.integers(1, 5)), int(rng.integers(0, 7))
+        y = rng.integers(-5, 9, size=n)
+        candidates = np.array([x for x in itertools.product(range(c + 1), repeat=n) if sum(x) == c])
+        best = np.min(((candidates - y) ** 2).sum(axis=1))
+        x = np.asarray(l2_simplex_opt(y, c))
+        assert x.sum() == c and np.all(x >= 0)
+        assert ((x - y) ** 2).sum() == best
@@ -0,0 +1,80 @@
+import os
+import sys
+import argparse
+import numpy as np
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from differential_privacy import BufferedGaussianNoise, DiscreteGaussianTail, sample_discrete_gaussian
+from mechanism.TDA import _get_complement, _get_options, _sparse_noise
+from optimization import l2_simplex_opt, standard_int_opt
+
+
+def test_get_complement():
+    # the positions not in taken are 0, 2, 5, 6, ...
+    taken = np.array([1, 3, 4])
+    assert _get_complement(taken, np.array([0, 1, 2, 3])).tolist() == [0, 2, 5, 6]
+    rng = np.random.default_rng(0)
+    for _ in range(100):
+        size = int(rng.integers(1, 50))
+        taken = np.sort(rng.choice(size, int(rng.integers(0, size)), replace=False))
+        complement = np.setdiff1d(np.arange(size), taken)
+        indices = np.sort(rng.choice(len(complement), int(rng.integers(0, len(complement) + 1)), replace=False))
+        assert _get_complement(taken, indices).tolist() == complement[indices].tolist()
+
+
+def test_reveal_support():
+    tail = DiscreteGaussianTail(2.)
+    rng = np.random.default_rng(1)
+    for lower, upper in ((-np.inf, tail.bound), (0, 5), (2.5, 4), (3, 3)):
+        indices, values = tail.reveal(1000, lower, upper, rng)
+        assert np.all(np.diff(indices) > 0) and np.all((indices >= 0) & (indices < 1000))
+        assert np.all((values > lower) & (values <= upper))
+    assert len(tail.reveal(1000, 3, 3, rng)[0]) == 0
+
+
+def test_reveal_distribution():
+    # the revealed noise has the distribution of the discrete Gaussian conditioned on the interval
+    scale, size, lower, upper = 2., 200, 1, 6
+    tail = DiscreteGaussianTail(scale)
+    rng = np.random.default_rng(2)
+    z = sample_discrete_gaussian(scale, 10 ** 6, rng)
+    z = z[z <= upper]
+    revealed = np.concatenate([tail.reveal(size, lower, upper, rng)[1] for _ in range(2000)])
+    # number of revealed values, binomial with 2000 * size trials
+    p = np.mean(z > lower)
+    assert abs(len(revealed) / (2000 * size) - p) < 5 * np.sqrt(p * (1 - p) / (2000 * size))
+    for value in range(lower + 1, upper + 1):
+        expected = np.mean(z[z > lower] == value)
+        assert abs(np.mean(revealed == value) - expected) < 5 * np.sqrt(expected / len(revealed)) + 1e-3
+
+
+def test_sparse_noise_matches_dense():
+    # the projection of the sparse noise has the distribution of the projection of the dense noise
+    positions, values, size, constraint, scale = np.array([3, 10, 20]), np.array([5, 2, 9]), 30, 16, 2.
+    dense_values = np.zeros(size, dtype=np.int64)
+    dense_values[positions] = values
+    noise = BufferedGaussianNoise(scale, seed=3)
+    draws = 4000
+    dense, sparse = np.zeros((draws, size)), np.zeros((draws, size))
+    for k in range(draws):
+        dense[k] = l2_simplex_opt(dense_values + sample_discrete_gaussian(scale, size, noise.rng), constraint)
+        sparse_positions, noisy_values = _sparse_noise(noise, (0, 0), constraint, positions, values, size)
+        sparse[k, sparse_positions] = l2_simplex_opt(noisy_values, constraint)
+    assert np.all(sparse.sum(axis=1) == constraint)
+    se = np.sqrt((dense.var(axis=0) + sparse.var(axis=0)) / draws) + 1e-9
+    assert np.max(np.abs(dense.mean(axis=0) - sparse.mean(axis=0)) / se) < 4.5
+
+
+def test_sparse_engine_needs_l2_simplex():
+    # the rounding of standard_int can give the unit to a zero child outside the support, never seen by the sparse
+    # engine, while l2_simplex keeps it in the support
+    y = np.array([0, 0, 0, 5, 5, 5, 0, 0, 0, 0])
+    assert np.asarray(standard_int_opt(y, 1, p=2)).tolist() == [1, 0, 0, 0, 0, 0, 0, 0, 0, 0]
+    assert np.asarray(l2_simplex_opt(y, 1)).tolist() == [0, 0, 0, 1, 0, 0, 0, 0, 0, 0]
+    args = argparse.Namespace(optimizer="standard_int", p=2, engine="sparse", noise="keyed", seed=0)
+    with pytest.raises(ValueError, match="l2_simplex"):
+        _get_options(args)
+    args.optimizer = "l2_simplex"
+    assert _get_options(args)[0] is l2_simplex_opt
@@ -0,0 +1,63 @@
+import os
+import sys
+import argparse
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from mechanism import TDA, ShardedTDA
+
+# the module, mechanism.TDA is the function
+tda_module = sys.modules["mechanism.TDA"]
+
+
+def get_args(**kwargs) -> argparse.Namespace:
+    args = dict(epsilon=1, delta=1e-8, split_method="uniform", optimizer="fast_int_opt", p="inf", show_tqdm=False,
+                noise="keyed", seed=7, batch_size=2)
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+
+
+def sort(data: pd.DataFrame) -> pd.DataFrame:
+    return data.sort_values(list(data.columns)).reset_index(drop=True)
+
+
+def test_resume_reproduces_the_full_run(tree, tmp_path, monkeypatch):
+    full = TDA(tree, get_args())
+    checkpoint = str(tmp_path / "checkpoint.npz")
+    # stopped after level 2, with the checkpoint of the released levels
+    level, _ = TDA(tree, get_args(checkpoint=checkpoint, stop_level=2))
+    assert level == 2 and os.path.exists(checkpoint)
+    # the resumed run releases only the levels after the checkpoint
+    levels = []
+    optimize_chunk = tda_module._optimize_chunk
+
+    def record_level(Tree, level, *args, **kwargs):
+        levels.append(level)
+        return optimize_chunk(Tree, level, *args, **kwargs)
+
+    monkeypatch.setattr(tda_module, "_optimize_chunk", record_level)
+    resumed = TDA(tree, get_args(checkpoint=checkpoint, resume=True))
+    assert sorted(set(levels)) == [3, 4]
+    assert sort(resumed).equals(sort(full))
+    assert not os.path.exists(checkpoint)
+
+
+def test_resume_rejects_another_run(tree, tmp_path):
+    checkpoint = str(tmp_path / "checkpoint.npz")
+    TDA(tree, get_args(checkpoint=checkpoint, stop_level=2))
+    with pytest.raises(ValueError, match="different run"):
+        TDA(tree, get_args(checkpoint=checkpoint, resume=True, seed=8))
+
+
+@pytest.mark.parametrize("options", [dict(engine="vectorized"), dict(workers=2), dict(traversal="depth"),
+                                     dict(engine="vectorized", traversal="depth", batch_size=1)])
+def test_keyed_release_does_not_depend_on_the_execution(tree, options):
+    node = TDA(tree, get_args())
+    assert sort(TDA(tree, get_args(**options))).equals(sort(node))
+
+
+def test_sharded_release_equals_tda(tree):
+    node = TDA(tree, get_args())
+    assert sort(ShardedTDA(tree, get_args(shards=2))).equals(sort(node))